@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 from enum import IntFlag
+import numpy as np
 from lib.math3d import *
 from utils.mixins import BitMixin
 
@@ -20,6 +21,7 @@ class ETextureFilterMode(IntFlag):
     """纹理滤波模式"""
     Point = 0
     Bilinear = 1
+    Trilinear = 2
 
 
 class Material(object):
@@ -30,6 +32,7 @@ class Material(object):
         self.textureFilterMode = ETextureFilterMode.Point
         self.color = ColorDefine.White
         self.ka = self.kd = self.ks = 0.0
+        # 纹理（graphics.texture.Texture），None表示没有纹理
         self.texture = None
         self.textureSize = (0, 0)
 
@@ -44,6 +47,8 @@ class EPolyState(IntFlag):
     Clipped = 2
     BackFace = 4
     Lit = 8
+    # 加入渲染列表时已在局部坐标中确定是正面，CheckBackFace不再检测
+    FrontFace = 16
 
 
 class Poly(BitMixin):
@@ -57,6 +62,10 @@ class Poly(BitMixin):
         self.tvList = []
         self.vIndexList = []
         self.normal = Vector4()
+        # 顶点池模式下多边形不保存顶点，vIndexList是顶点池中的下标
+        self.pool = None
+        # 所属物体在渲染列表中的序号，与vIndexList一起唯一确定一个顶点，-1表示顶点不再对应物体的顶点（例如被裁剪过）
+        self.objectIndex = -1
 
     def IsEnabled(self):
         return self.state & EPolyState.Active and \
@@ -94,8 +103,12 @@ class Poly(BitMixin):
 
     def GetNormal(self):
         if self.normal.IsZero():
-            v01 = self.tvList[1].pos - self.tvList[0].pos
-            v02 = self.tvList[2].pos - self.tvList[0].pos
+            if self.pool is not None and not self.tvList:
+                p0, p1, p2 = (self.pool.GetPosition(i) for i in self.vIndexList[:3])
+            else:
+                p0, p1, p2 = (v.pos for v in self.tvList[:3])
+            v01 = p1 - p0
+            v02 = p2 - p0
             self.normal = Vector4.Cross(v01, v02)
             self.normal.Normalize()
         return self.normal
@@ -176,3 +189,71 @@ class Vertex(object):
 
     def __str__(self):
         return 'Pos: {}, Normal: {}, Texture: {}'.format(self.pos, self.normal, self.textureCoord)
+
+
+class VertexPool(object):
+    """顶点池（结构数组）
+    所有顶点的位置、法线（N*4）、纹理坐标（N*2）和颜色（N*4）分别存放在连续的numpy数组中，
+    多边形只保存顶点在池中的下标，内存与不重复的顶点数成正比而不是与多边形的角数成正比
+    """
+
+    def __init__(self, capacity=16):
+        capacity = max(capacity, 1)
+        self.count = 0
+        self.__positions = np.zeros((capacity, 4), dtype=np.float64)
+        self.__normals = np.zeros((capacity, 4), dtype=np.float64)
+        self.__textureCoords = np.zeros((capacity, 2), dtype=np.float64)
+        self.__colors = np.zeros((capacity, 4), dtype=np.float64)
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def positions(self):
+        return self.__positions[:self.count]
+
+    @property
+    def normals(self):
+        return self.__normals[:self.count]
+
+    @property
+    def textureCoords(self):
+        return self.__textureCoords[:self.count]
+
+    @property
+    def colors(self):
+        return self.__colors[:self.count]
+
+    def Add(self, pos, normal=None, textureCoord=None, color=None):
+        """添加一个顶点，返回它在池中的下标"""
+        if self.count == len(self.__positions):
+            self.__Grow(2 * self.count)
+        i = self.count
+        self.__positions[i] = (pos.x, pos.y, pos.z, pos.w)
+        if normal:
+            self.__normals[i] = (normal.x, normal.y, normal.z, normal.w)
+        if textureCoord:
+            self.__textureCoords[i] = (textureCoord.x, textureCoord.y)
+        color = color or Color()
+        self.__colors[i] = (color.r, color.g, color.b, color.a)
+        self.count += 1
+        return i
+
+    def GetPosition(self, i):
+        return Vector4(*self.__positions[i].tolist())
+
+    def GetVertex(self, i):
+        """取出第i个顶点（复制成Vertex对象）"""
+        return Vertex(pos=Vector4(*self.__positions[i].tolist()),
+                      normal=Vector4(*self.__normals[i].tolist()),
+                      textureCoord=Point(*self.__textureCoords[i].tolist()),
+                      color=Color(*self.__colors[i].tolist()))
+
+    def __Grow(self, capacity):
+        """扩容时容量翻倍，新的部分清零"""
+        arrays = []
+        for data in (self.__positions, self.__normals, self.__textureCoords, self.__colors):
+            newData = np.zeros((capacity,) + data.shape[1:], dtype=data.dtype)
+            newData[:self.count] = data[:self.count]
+            arrays.append(newData)
+        self.__positions, self.__normals, self.__textureCoords, self.__colors = arrays
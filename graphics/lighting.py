@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import numpy as np
 import utils.log as log
 from lib.math3d import Vector4, Color
 
@@ -13,6 +14,23 @@ class Light(object):
         log.logger.debug(
             'Result color: {}, light color: {}, poly color: {}'.format(resultColor, self.color, poly.material.color))
 
+    def GetState(self):
+        """光源的状态，状态相同的光源计算结果相同（用于判断光照缓存是否失效）"""
+        return type(self), self.isOn, (self.color.r, self.color.g, self.color.b)
+
+    def CalculateBatch(self, resultColors, normals, positions, baseColors):
+        """批量计算光照，把这个光源的贡献累加到resultColors（N*3的RGB，不做截断）上
+        normals、positions为N*3的法线和位置，baseColors为N*3的材质颜色，与Calculate逐个计算的结果相同
+        """
+        pass
+
+    def _Modulate(self, intensity, baseColors):
+        """与Color.Multiply相同：光源颜色乘以强度再乘以材质颜色，除以256后向下取整"""
+        lightColor = np.array((self.color.r, self.color.g, self.color.b), dtype=np.float64)
+        if intensity is None:
+            return (lightColor * baseColors) // 256
+        return (lightColor * intensity[:, None] * baseColors) // 256
+
     def Turn(self, isOn):
         self.isOn = isOn
 
@@ -31,6 +49,9 @@ class AmbientLight(Light):
                 Color.Multiply(rc, self.color, poly.material.color)
         super(AmbientLight, self).Calculate(resultColor, poly)
 
+    def CalculateBatch(self, resultColors, normals, positions, baseColors):
+        resultColors += self._Modulate(None, baseColors)
+
 
 class DirectionalLight(Light):
     """方向光"""
@@ -59,6 +80,15 @@ class DirectionalLight(Light):
             i = dp
             Color.Multiply(resultColor, self.color * i, baseColor)
 
+    def GetState(self):
+        return super(DirectionalLight, self).GetState() + (self.direction.vector,)
+
+    def CalculateBatch(self, resultColors, normals, positions, baseColors):
+        d = self.direction
+        dp = normals[:, 0] * d.x + normals[:, 1] * d.y + normals[:, 2] * d.z
+        lit = dp > 0
+        resultColors[lit] += self._Modulate(dp[lit], baseColors[lit])
+
 
 class PointLight(Light):
     """点光源"""
@@ -93,3 +123,15 @@ class PointLight(Light):
             a = self.params[0] + self.params[1] * dist + self.params[2] * dist * dist
             i = dp / dist / a
             Color.Multiply(resultColor, self.color * i, baseColor)
+
+    def GetState(self):
+        return super(PointLight, self).GetState() + (self.pos.vector, self.params)
+
+    def CalculateBatch(self, resultColors, normals, positions, baseColors):
+        l = np.array((self.pos.x, self.pos.y, self.pos.z), dtype=np.float64) - positions
+        dist = np.sqrt(l[:, 0] ** 2 + l[:, 1] ** 2 + l[:, 2] ** 2)
+        dp = normals[:, 0] * l[:, 0] + normals[:, 1] * l[:, 1] + normals[:, 2] * l[:, 2]
+        lit = dp > 0
+        dist = dist[lit]
+        a = self.params[0] + self.params[1] * dist + self.params[2] * dist * dist
+        resultColors[lit] += self._Modulate(dp[lit] / dist / a, baseColors[lit])
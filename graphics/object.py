@@ -2,13 +2,13 @@
 
 import utils.log as log
 import math
-import copy
 import collections
 from enum import IntFlag, Enum
+import numpy as np
 
 from lib.math3d import *
 from graphics.base import *
-from graphics.render import Buffer, RenderBuffer
+from graphics.render import Buffer, RenderBuffer, ParallelRasterizer
 from graphics.lighting import *
 from utils.mixins import BitMixin
 
@@ -28,18 +28,103 @@ class Camera(object):
         self.cameraType = cameraType
         self.lookAt = lookAt
 
-        self.aspectRatio = float(viewportWidth) / viewportHeight
         self.viewPlaneWidth = 2.0
-        self.viewPlaneHeight = 2.0 / self.aspectRatio
-
-        self.viewDist = 0.5 * self.viewPlaneWidth * math.tan(math.radians(fieldOfView / 2))
-        self.fieldOfView = fieldOfView
         self.nearClipZ = nearClipZ
         self.farClipZ = farClipZ
+        self.SetViewport(viewportWidth, viewportHeight)
+        self.SetFieldOfView(fieldOfView)
+
+        # 缓存的视图矩阵、视图投影矩阵和视锥体平面，以及计算它们时的相机参数（参数改变时缓存失效）
+        self.__cacheKey = None
+        self.__viewMatrix = None
+        self.__viewProjectionMatrix = None
+        self.__screenMatrix = None
+        self.__frustumPlanes = None
+
+    def SetFieldOfView(self, fieldOfView):
+        """设置视野角度（水平方向），同时更新视距"""
+        self.fieldOfView = fieldOfView
+        self.viewDist = 0.5 * self.viewPlaneWidth * math.tan(math.radians(fieldOfView / 2))
+
+    def SetViewport(self, viewportWidth, viewportHeight):
+        """设置视口大小，同时更新宽高比和视平面高度"""
         self.viewportWidth = viewportWidth
         self.viewportHeight = viewportHeight
+        self.aspectRatio = float(viewportWidth) / viewportHeight
+        self.viewPlaneHeight = 2.0 / self.aspectRatio
 
     def GetViewMatrix(self):
+        """获取视图矩阵（世界坐标变换到相机坐标），相机参数不变时直接返回缓存"""
+        self.__UpdateCache()
+        return self.__viewMatrix
+
+    def GetProjectionMatrix(self):
+        """获取透视投影矩阵：相机坐标(x, y, z, 1)变换到齐次裁剪坐标(d * x, d * aspect * y, z, z)，
+        除以w后x和y在[-1, 1]内的点在视野内，w保留了相机空间的z
+        """
+        return Matrix4x4([[self.viewDist, 0, 0, 0],
+                          [0, self.viewDist * self.aspectRatio, 0, 0],
+                          [0, 0, 1, 1],
+                          [0, 0, 0, 0]])
+
+    def GetViewProjectionMatrix(self):
+        """获取视图矩阵与投影矩阵的乘积（世界坐标直接变换到齐次裁剪坐标）"""
+        self.__UpdateCache()
+        if self.__viewProjectionMatrix is None:
+            self.__viewProjectionMatrix = self.__viewMatrix * self.GetProjectionMatrix()
+        return self.__viewProjectionMatrix
+
+    def GetViewportMatrix(self):
+        """获取视口矩阵：齐次裁剪坐标变换到齐次屏幕坐标，除以w后得到屏幕坐标（x向右，y向下）"""
+        alpha = 0.5 * self.viewportWidth - 0.5
+        beta = 0.5 * self.viewportHeight - 0.5
+        return Matrix4x4([[alpha, 0, 0, 0],
+                          [0, -beta, 0, 0],
+                          [0, 0, 1, 0],
+                          [alpha, beta, 0, 1]])
+
+    def GetScreenMatrix(self):
+        """获取视图、投影和视口矩阵的乘积（世界坐标直接变换到齐次屏幕坐标，w为相机空间的z）"""
+        self.__UpdateCache()
+        if self.__screenMatrix is None:
+            self.__screenMatrix = self.GetViewProjectionMatrix() * self.GetViewportMatrix()
+        return self.__screenMatrix
+
+    def GetFrustumPlanes(self):
+        """获取世界坐标下视锥体的6个平面（近、远、左、右、下、上），返回6*4的数组，
+        每行(a, b, c, d)的法线指向视锥体内并已归一化，点p到平面的有向距离为a * p.x + b * p.y + c * p.z + d
+        """
+        self.__UpdateCache()
+        if self.__frustumPlanes is None:
+            # 相机坐标下的平面，左右和上下平面与CullObject的判断一致：|x| <= z * 0.5 * viewPlaneWidth / viewDist
+            kx = 0.5 * self.viewPlaneWidth / self.viewDist
+            ky = 0.5 * self.viewPlaneHeight / self.viewDist
+            planes = np.array([[0, 0, 1, -self.nearClipZ],
+                               [0, 0, -1, self.farClipZ],
+                               [1, 0, kx, 0],
+                               [-1, 0, kx, 0],
+                               [0, 1, ky, 0],
+                               [0, -1, ky, 0]], dtype=np.float64)
+            # 相机坐标p_cam = p_world * V，所以世界坐标下的平面为V * plane
+            planes = planes @ np.array(self.__viewMatrix.data, dtype=np.float64).T
+            self.__frustumPlanes = planes / np.linalg.norm(planes[:, :3], axis=1)[:, None]
+        return self.__frustumPlanes
+
+    def __UpdateCache(self):
+        """相机参数与上次计算时不同（位置、方向、观察点、视野或视口改变）时重新计算视图矩阵并清空其它缓存"""
+        key = (self.cameraType, self.pos.x, self.pos.y, self.pos.z,
+               self.direction.x, self.direction.y, self.direction.z, self.lookAt.x, self.lookAt.y, self.lookAt.z,
+               self.viewDist, self.aspectRatio, self.viewPlaneWidth, self.viewPlaneHeight,
+               self.nearClipZ, self.farClipZ, self.viewportWidth, self.viewportHeight)
+        if key == self.__cacheKey:
+            return
+        self.__cacheKey = key
+        self.__viewMatrix = self.__BuildViewMatrix()
+        self.__viewProjectionMatrix = None
+        self.__screenMatrix = None
+        self.__frustumPlanes = None
+
+    def __BuildViewMatrix(self):
         result = None
         if self.cameraType == ECameraType.Euler:
             rotate = Matrix4x4.GetRotateMatrix(-self.direction.x, -self.direction.y, -self.direction.z)
@@ -56,6 +141,7 @@ class Camera(object):
             u.Normalize()
             v.Normalize()
             n.Normalize()
+            self.u, self.v, self.n = u, v, n
 
             translate = Matrix4x4([[1, 0, 0, 0],
                                    [0, 1, 0, 0],
@@ -101,6 +187,20 @@ class Camera(object):
             log.logger.debug('Cull object at pos %s, cull plane = %s', obj.worldPos, cullPlane)
         return culled
 
+    def CullSpheres(self, centers, radii):
+        """批量剔除包围球，centers为N*3的世界坐标球心，radii为N个半径，返回被剔除的掩码（判断方法与CullObject相同）"""
+        centers = np.asarray(centers, dtype=np.float64)
+        radii = np.asarray(radii, dtype=np.float64)
+        matrix = np.array(self.GetViewMatrix().data, dtype=np.float64)
+        spherePos = centers @ matrix[:3, :3] + matrix[3, :3]
+        x, y, z = spherePos[:, 0], spherePos[:, 1], spherePos[:, 2]
+        culled = (z - radii > self.farClipZ) | (z + radii < self.nearClipZ)
+        zTest = 0.5 * self.viewPlaneWidth * z / self.viewDist
+        culled |= (x - radii > zTest) | (x + radii < -zTest)
+        zTest = 0.5 * self.viewPlaneHeight * z / self.viewDist
+        culled |= (y - radii > zTest) | (y + radii < -zTest)
+        return culled
+
 
 # region 游戏物体
 class EGameObjectState(IntFlag):
@@ -128,6 +228,12 @@ class GameObject(BitMixin):
         self.worldPos = Vector4()
         self.rotation = Vector4()
         self.scale = 1
+        # 缓存的模型矩阵（缩放、旋转、平移），变换参数改变时置为None，下次使用时重新计算
+        self.__modelMatrix = None
+        # 缓存的局部顶点坐标数组（N*4），增加顶点时置为None
+        self.__localPositions = None
+        # 缓存的局部坐标下每个多边形的第一个顶点和面法线（未归一化），增加顶点或多边形时置为None
+        self.__faceData = None
 
         self.vListLocal = []
         self.vListTrans = []
@@ -135,6 +241,10 @@ class GameObject(BitMixin):
         self.vertexToPolyDict = collections.defaultdict(list)
         self.textureVertexList = []
         self.material = Material()
+        # 顶点池模式（调用ConvertToVertexPool后）：局部顶点存放在顶点池中，多边形只保存下标，
+        # worldPositions是变换到世界坐标后的顶点位置（N*4，两种模式都有）
+        self.vertexPool = None
+        self.worldPositions = None
 
         # 平均半径和最大半径
         self.averageRadius = 0
@@ -151,6 +261,8 @@ class GameObject(BitMixin):
 
     def AddVertex(self, v):
         self.vListLocal.append(v)
+        self.__localPositions = None
+        self.__faceData = None
         vCopy = Vertex()
         vCopy.SetPosition(v.pos)
         vCopy.SetNormal(v.normal)
@@ -158,6 +270,7 @@ class GameObject(BitMixin):
 
     def AddPoly(self, p):
         self.polyList.append(p)
+        self.__faceData = None
 
     def SetTransform(self, scale=1, eulerRotation=(0, 0, 0), worldPos=Vector4()):
         """设置基本变换"""
@@ -169,17 +282,26 @@ class GameObject(BitMixin):
     def SetScale(self, scale):
         """仅缩放局部坐标，最好在加载完物体之后调用"""
         self.scale = scale
+        self.__modelMatrix = None
 
     def SetWorldPosition(self, worldPos):
         """设置世界坐标"""
         self.worldPos = worldPos
+        self.__modelMatrix = None
 
     def SetEulerRotation(self, x=0, y=0, z=0):
         """设置旋转（使用欧拉角）"""
         self.rotation = Vector4(x, y, z)
+        self.__modelMatrix = None
 
     def CalculateRadius(self):
         """计算平均半径和最大半径"""
+        if self.vertexPool is not None:
+            distances = np.linalg.norm(self.vertexPool.positions[:, :3] * self.scale, axis=1)
+            self.averageRadius = distances.sum() / len(distances)
+            self.maxRadius = distances.max()
+            return
+
         sumDistance = 0
         maxDistance = 0
         for v in self.vListLocal:
@@ -192,19 +314,127 @@ class GameObject(BitMixin):
         self.maxRadius = maxDistance
         log.logger.debug('Average radius = {}, max radius = {}'.format(self.averageRadius, self.maxRadius))
 
+    def GetLocalPositions(self):
+        """获取局部顶点坐标数组（N*4）"""
+        if self.vertexPool is not None:
+            return self.vertexPool.positions
+        if self.__localPositions is None:
+            self.__localPositions = np.array([(v.pos.x, v.pos.y, v.pos.z, 1) for v in self.vListLocal],
+                                             dtype=np.float64).reshape(-1, 4)
+        return self.__localPositions
+
+    def GetModelMatrix(self):
+        """获取模型矩阵（先缩放，再旋转，最后平移到世界坐标）"""
+        if self.__modelMatrix is None:
+            self.__modelMatrix = Matrix4x4.GetScaleMatrix(self.scale) * \
+                                 Matrix4x4.GetRotateMatrix(self.rotation.x, self.rotation.y, self.rotation.z) * \
+                                 Matrix4x4.GetTranslateMatrix(self.worldPos.x, self.worldPos.y, self.worldPos.z)
+        return self.__modelMatrix
+
+    def GetFrontFaces(self, cameraPos, modelMatrices):
+        """在局部坐标中判断多边形是否正对相机，返回K*P的掩码（K为模型矩阵的个数，P为多边形个数）
+        相机位置用模型矩阵的逆变换到局部坐标，再与预先算好的面法线比较，与RenderList.CheckBackFace在世界坐标中的判断等价：
+        对线性部分为A的仿射变换，世界坐标中的点积等于det(A)乘以局部坐标中的点积，所以det(A) < 0时（镜像）结果取反
+        """
+        if self.__faceData is None:
+            positions = self.GetLocalPositions()[:, :3]
+            indices = np.array([poly.vIndexList[:3] for poly in self.polyList], dtype=np.int64).reshape(-1, 3)
+            p0, p1, p2 = positions[indices[:, 0]], positions[indices[:, 1]], positions[indices[:, 2]]
+            self.__faceData = (p0, np.cross(p1 - p0, p2 - p0))
+        p0, normals = self.__faceData
+
+        modelMatrices = np.asarray(modelMatrices, dtype=np.float64).reshape(-1, 4, 4)
+        cameraLocal = np.matmul(np.array((cameraPos.x, cameraPos.y, cameraPos.z, 1), dtype=np.float64),
+                                np.linalg.inv(modelMatrices))
+        cameraLocal = cameraLocal[:, :3] / cameraLocal[:, 3:]
+        sign = np.sign(np.linalg.det(modelMatrices[:, :3, :3]))[:, None]
+        dp = ((cameraLocal[:, None, :] - p0) * normals).sum(axis=2)
+        return sign * dp > 0
+
+    def ConvertToVertexPool(self):
+        """转换成顶点池存储：引用同一个物体顶点且纹理坐标相同的多边形顶点合并为池中的一个顶点，
+        多边形只保留顶点在池中的下标，之后不再保存顶点列表（vListLocal和vListTrans）
+        """
+        pool = VertexPool(len(self.vListLocal))
+        indexDict = {}
+        for poly in self.polyList:
+            indices = []
+            for i, tv in zip(poly.vIndexList, poly.tvList):
+                key = (i, tv.textureCoord.x, tv.textureCoord.y)
+                if key not in indexDict:
+                    v = self.vListLocal[i]
+                    indexDict[key] = pool.Add(v.pos, v.normal, tv.textureCoord)
+                indices.append(indexDict[key])
+            poly.vList = []
+            poly.tvList = []
+            poly.vIndexList = indices
+            poly.pool = pool
+
+        self.vertexPool = pool
+        self.vListLocal = []
+        self.vListTrans = []
+        self.vertexToPolyDict.clear()
+        self.__localPositions = None
+        self.__faceData = None
+
     def TransformModelToWorld(self):
-        """模型坐标变换到世界坐标"""
-        for i in range(len(self.vListLocal)):
-            # 缩放
-            vScale = self.vListLocal[i].pos * self.scale
-            # 旋转
-            rotationMatrix = Matrix4x4.GetRotateMatrix(self.rotation.x, self.rotation.y, self.rotation.z)
-            vRotation = vScale * rotationMatrix
-            # 平移
-            vTranslate = self.worldPos + vRotation
+        """模型坐标变换到世界坐标，所有顶点一次性与模型矩阵相乘"""
+        positions = self.GetLocalPositions() @ np.array(self.GetModelMatrix().data, dtype=np.float64)
+        self.worldPositions = positions
+        if self.vertexPool is not None:
+            return
+
+        for vertex, (x, y, z, w) in zip(self.vListTrans, positions.tolist()):
+            vertex.pos = Vector4(x, y, z)
 
-            self.vListTrans[i].pos = vTranslate
-            log.logger.debug('world pos = {}, vListTrans[i].pos = {}'.format(self.worldPos, self.vListTrans[i].pos))
+
+class GameObjectInstance(BitMixin):
+    """物体的实例：共享原物体（mesh）的顶点和多边形数据，只保存自己的变换和材质
+    实例的变换直接作用于mesh的局部坐标（不使用mesh自己的变换）；material不为None时代替mesh的材质，
+    包围球半径在创建时由mesh的局部顶点坐标算出（不依赖mesh是否调用过CalculateRadius），再按实例的缩放换算
+    """
+
+    def __init__(self, mesh, worldPos=None, eulerRotation=(0, 0, 0), scale=1, material=None):
+        super(GameObjectInstance, self).__init__()
+        self.state = EGameObjectState.Active | EGameObjectState.Visible
+        self.mesh = mesh
+        self.material = material
+        self.worldPos = worldPos or Vector4()
+        self.rotation = Vector4(*eulerRotation)
+        self.scale = scale
+        self.__modelMatrix = None
+        # 局部坐标中顶点到原点的最大距离
+        positions = mesh.GetLocalPositions()[:, :3]
+        self.__localRadius = float(np.linalg.norm(positions, axis=1).max()) if len(positions) else 0.0
+
+    def IsEnabled(self):
+        return self.state & EGameObjectState.Active and \
+               self.state & EGameObjectState.Visible and \
+               not self.state & EGameObjectState.Culled
+
+    @property
+    def maxRadius(self):
+        return self.__localRadius * abs(self.scale)
+
+    def SetScale(self, scale):
+        self.scale = scale
+        self.__modelMatrix = None
+
+    def SetWorldPosition(self, worldPos):
+        self.worldPos = worldPos
+        self.__modelMatrix = None
+
+    def SetEulerRotation(self, x=0, y=0, z=0):
+        self.rotation = Vector4(x, y, z)
+        self.__modelMatrix = None
+
+    def GetModelMatrix(self):
+        """获取模型矩阵（先缩放，再旋转，最后平移到世界坐标）"""
+        if self.__modelMatrix is None:
+            self.__modelMatrix = Matrix4x4.GetScaleMatrix(self.scale) * \
+                                 Matrix4x4.GetRotateMatrix(self.rotation.x, self.rotation.y, self.rotation.z) * \
+                                 Matrix4x4.GetTranslateMatrix(self.worldPos.x, self.worldPos.y, self.worldPos.z)
+        return self.__modelMatrix
 
 
 # endregion
@@ -224,8 +454,25 @@ class RenderList(object):
         self.camera = camera
         self.sortPolyMethod = sortPolyMethod
         self.polyList = []
-
-    def AddObject(self, obj, useObjectMaterial=False):
+        # 本帧已加入的物体数量，用于给多边形标记所属物体
+        self.objectCount = 0
+        # 本帧已加入的物体的世界坐标顶点数组（按物体序号），多边形通过（物体序号，顶点索引）引用其中的顶点
+        self.objectPositions = []
+        # Reset回收的多边形（连同顶点对象），AddObject和ClipPoly优先从这里分配，稳定后每帧几乎不再创建多边形和顶点
+        self.__freePolys = []
+        # Gouraud着色的顶点光照缓存：（物体序号，顶点索引，材质颜色）-> 颜色，以及计算缓存时的光源状态
+        self.__vertexLightingCache = {}
+        self.__lightingState = None
+        # 上一帧Sort得到的顺序（排序前多边形的下标），用于增量排序
+        self.__sortOrder = None
+        # 多进程分块并行光栅器，调用EnableParallelRender后才会创建
+        self.parallelRasterizer = None
+
+    def AddObject(self, obj, useObjectMaterial=False, removeBackFace=False):
+        """把物体的多边形加入渲染列表
+        removeBackFace为True时在局部坐标中剔除背面（见GameObject.GetFrontFaces），背面多边形不会被复制和变换，
+        结果与加入后再调用CheckBackFace相同；加入的多边形带有EPolyState.FrontFace，CheckBackFace会跳过它们
+        """
         if not obj.IsEnabled():
             return
 
@@ -234,21 +481,156 @@ class RenderList(object):
             return
 
         obj.TransformModelToWorld()
+        objectIndex = self.objectCount
+        self.objectCount += 1
+        self.objectPositions.append(obj.worldPositions)
+        frontFaces = None
+        state = EPolyState.Active
+        if removeBackFace:
+            frontFaces = obj.GetFrontFaces(self.camera.pos, obj.GetModelMatrix().data)[0].tolist()
+            state |= EPolyState.FrontFace
+
+        if obj.vertexPool is not None:
+            self.__AddPooledObject(obj, objectIndex, useObjectMaterial, frontFaces, state)
+            return
 
-        for poly in obj.polyList:
-            if not poly.IsEnabled():
+        for k, poly in enumerate(obj.polyList):
+            if not poly.IsEnabled() or (frontFaces and not frontFaces[k]):
                 continue
 
             # useObjectMaterial决定了使用物体的材质还是多边形的材质
-            newPoly = Poly(obj.material if useObjectMaterial else poly.material)
-            index = 0
-            for i in poly.vIndexList:
-                newPoly.AddVertex(i, obj.vListTrans[i], poly.tvList[index].textureCoord)
-                index += 1
+            newPoly = self.__AllocatePoly(obj.material if useObjectMaterial else poly.material, objectIndex,
+                                          len(poly.vIndexList), state)
+            newPoly.vIndexList.extend(poly.vIndexList)
+            for v, i, tv in zip(newPoly.tvList, poly.vIndexList, poly.tvList):
+                vertex = obj.vListTrans[i]
+                self.__SetVertex(v, vertex.pos, vertex.normal.vector, (tv.textureCoord.x, tv.textureCoord.y))
+            self.polyList.append(newPoly)
+
+    def __AddPooledObject(self, obj, objectIndex, useObjectMaterial, frontFaces=None, state=EPolyState.Active):
+        """添加顶点池模式的物体，直接从顶点池的数组生成渲染多边形的顶点"""
+        positions = [Vector4(*pos) for pos in obj.worldPositions.tolist()]
+        normals = obj.vertexPool.normals.tolist()
+        textureCoords = obj.vertexPool.textureCoords.tolist()
+        for k, poly in enumerate(obj.polyList):
+            if not poly.IsEnabled() or (frontFaces and not frontFaces[k]):
+                continue
+
+            newPoly = self.__AllocatePoly(obj.material if useObjectMaterial else poly.material, objectIndex,
+                                          len(poly.vIndexList), state)
+            newPoly.vIndexList.extend(poly.vIndexList)
+            for v, i in zip(newPoly.tvList, poly.vIndexList):
+                self.__SetVertex(v, positions[i], normals[i], textureCoords[i])
             self.polyList.append(newPoly)
 
+    def __AllocatePoly(self, material, objectIndex=-1, numVertices=3, state=EPolyState.Active):
+        """分配一个渲染多边形：优先复用上一帧Reset回收的多边形和它的顶点对象，没有时才新建"""
+        if self.__freePolys:
+            poly = self.__freePolys.pop()
+            poly.material = material
+            poly.normal.x = poly.normal.y = poly.normal.z = 0
+            poly.vList.clear()
+            poly.vIndexList.clear()
+        else:
+            poly = Poly(material)
+        poly.state = state
+        poly.objectIndex = objectIndex
+        while len(poly.tvList) < numVertices:
+            poly.tvList.append(Vertex())
+        del poly.tvList[numVertices:]
+        return poly
+
+    @staticmethod
+    def __SetVertex(v, pos, normal, textureCoord, color=ColorDefine.Black):
+        """就地设置复用的顶点：位置和颜色直接引用（各阶段只替换不修改它们），法线和纹理坐标复制到顶点自己的对象中"""
+        v.pos = pos
+        v.normal.x, v.normal.y, v.normal.z, v.normal.w = normal
+        v.textureCoord.x, v.textureCoord.y = textureCoord
+        v.color = color
+
+    def AddInstances(self, instances, useObjectMaterial=False, removeBackFace=False):
+        """批量添加同一个mesh的多个实例
+        所有实例的包围球一次性剔除，剩下的实例的顶点用一次批量矩阵乘法变换到世界坐标，
+        多边形的顶点索引、法线和纹理坐标从mesh中只整理一次，所有实例共用；
+        实例有自己的材质时使用实例的材质，否则与AddObject一样由useObjectMaterial决定使用mesh还是多边形的材质。
+        实例的Culled状态每次调用时重新计算；removeBackFace为True时所有实例的背面一次性在局部坐标中剔除
+        """
+        instances = [instance for instance in instances if instance.state & EGameObjectState.Active and
+                     instance.state & EGameObjectState.Visible]
+        if not instances:
+            return
+        mesh = instances[0].mesh
+        assert all(instance.mesh is mesh for instance in instances)
+
+        centers = [(instance.worldPos.x, instance.worldPos.y, instance.worldPos.z) for instance in instances]
+        culled = self.camera.CullSpheres(centers, [instance.maxRadius for instance in instances]).tolist()
+        visibleInstances = []
+        for instance, isCulled in zip(instances, culled):
+            if isCulled:
+                instance.SetBit(EGameObjectState.Culled)
+            else:
+                instance.ResetBit(EGameObjectState.Culled)
+                visibleInstances.append(instance)
+        if not visibleInstances:
+            return
+
+        matrices = np.array([instance.GetModelMatrix().data for instance in visibleInstances], dtype=np.float64)
+        worldPositions = np.matmul(mesh.GetLocalPositions(), matrices)
+        templates = self.__GetPolyTemplates(mesh)
+        state = EPolyState.Active
+        if removeBackFace:
+            enabled = np.array([poly.IsEnabled() for poly in mesh.polyList], dtype=bool)
+            frontFaces = mesh.GetFrontFaces(self.camera.pos, matrices)[:, enabled].tolist()
+            state |= EPolyState.FrontFace
+        else:
+            frontFaces = [None] * len(visibleInstances)
+        for instance, positions, front in zip(visibleInstances, worldPositions, frontFaces):
+            objectIndex = self.objectCount
+            self.objectCount += 1
+            self.objectPositions.append(positions)
+            # 同一实例中的顶点共享位置（各阶段只替换不修改顶点的位置）
+            sharedPositions = [Vector4(x, y, z) for x, y, z, w in positions.tolist()]
+            for k, (vIndexList, normals, textureCoords, polyMaterial) in enumerate(templates):
+                if front and not front[k]:
+                    continue
+                if instance.material:
+                    material = instance.material
+                else:
+                    material = mesh.material if useObjectMaterial else polyMaterial
+                newPoly = self.__AllocatePoly(material, objectIndex, len(vIndexList), state)
+                newPoly.vIndexList.extend(vIndexList)
+                for v, i, normal, tc in zip(newPoly.tvList, vIndexList, normals, textureCoords):
+                    self.__SetVertex(v, sharedPositions[i], normal, tc)
+                self.polyList.append(newPoly)
+
+    @staticmethod
+    def __GetPolyTemplates(mesh):
+        """整理mesh中所有有效多边形的顶点索引、顶点法线、纹理坐标和材质"""
+        templates = []
+        if mesh.vertexPool is not None:
+            normals = mesh.vertexPool.normals.tolist()
+            textureCoords = mesh.vertexPool.textureCoords.tolist()
+        for poly in mesh.polyList:
+            if not poly.IsEnabled():
+                continue
+            if mesh.vertexPool is not None:
+                templates.append((poly.vIndexList, [normals[i] for i in poly.vIndexList],
+                                  [textureCoords[i] for i in poly.vIndexList], poly.material))
+            else:
+                templates.append((poly.vIndexList,
+                                  [mesh.vListTrans[i].normal.vector for i in poly.vIndexList],
+                                  [(tv.textureCoord.x, tv.textureCoord.y) for tv in poly.tvList],
+                                  poly.material))
+        return templates
+
     def Reset(self):
+        # 多边形回收到空闲列表中，下一帧复用
+        self.__freePolys.extend(self.polyList)
         self.polyList.clear()
+        self.objectCount = 0
+        self.objectPositions.clear()
+        # 物体的变换只在重新加入渲染列表时改变，顶点光照缓存随之失效
+        self.__vertexLightingCache.clear()
 
     def TransformWorldToCamera(self, camera):
         """世界坐标变换到相机坐标"""
@@ -260,6 +642,66 @@ class RenderList(object):
                 vertex.pos = vertex.pos * matrix
                 log.logger.debug('Vertex.pos = {}'.format(vertex.pos))
 
+    def TransformWorldToClip(self, camera):
+        """世界坐标一次性变换到齐次屏幕坐标（视图、投影和视口矩阵合成一个矩阵，所有顶点一起相乘）
+        结果的w分量为相机空间的z，z分量也等于相机空间的z；裁剪在这一步之后、透视除法之前进行。
+        属于物体的顶点直接从物体的世界坐标顶点数组中取，每个被引用的顶点只变换一次，
+        共享这个顶点的多边形的顶点引用同一个变换结果（各阶段都是替换而不是修改顶点的位置，所以可以共享）
+        """
+        matrix = np.array(camera.GetScreenMatrix().data, dtype=np.float64)
+        offsets = np.cumsum([0] + [len(positions) for positions in self.objectPositions]).tolist()
+        indexedVertices, rows, vertices = [], [], []
+        for poly in self.polyList:
+            if not poly.IsEnabled():
+                continue
+            if poly.objectIndex >= 0:
+                offset = offsets[poly.objectIndex]
+                indexedVertices.extend(poly.tvList)
+                rows.extend(offset + i for i in poly.vIndexList)
+            else:
+                vertices.extend(poly.tvList)
+
+        if indexedVertices:
+            rows, inverse = np.unique(np.array(rows, dtype=np.int64), return_inverse=True)
+            positions = np.concatenate(self.objectPositions)[rows] @ matrix
+            sharedPositions = [Vector4(x, y, z, w) for x, y, z, w in positions.tolist()]
+            for vertex, row in zip(indexedVertices, inverse.tolist()):
+                vertex.pos = sharedPositions[row]
+        if vertices:
+            positions = np.array([(v.pos.x, v.pos.y, v.pos.z, 1) for v in vertices], dtype=np.float64) @ matrix
+            for vertex, (x, y, z, w) in zip(vertices, positions.tolist()):
+                vertex.pos = Vector4(x, y, z, w)
+
+    def TransformClipToScreen(self):
+        """透视除法：齐次屏幕坐标的x和y一起除以w得到屏幕坐标，z保留相机空间的z（光栅化时使用1/z）
+        被多个多边形共享的位置只计算一次
+        """
+        vertices = self.__GetEnabledVertices()
+        if not vertices:
+            return
+        indexDict, uniquePositions, indices = {}, [], []
+        for v in vertices:
+            index = indexDict.get(id(v.pos))
+            if index is None:
+                index = indexDict[id(v.pos)] = len(uniquePositions)
+                uniquePositions.append(v.pos)
+            indices.append(index)
+        positions = np.array([(p.x, p.y, p.w) for p in uniquePositions], dtype=np.float64)
+        positions[:, :2] /= positions[:, 2:]
+        sharedPositions = [Vector4(x, y, z) for x, y, z in positions.tolist()]
+        for vertex, index in zip(vertices, indices):
+            vertex.pos = sharedPositions[index]
+
+    def TransformWorldToScreen(self, camera):
+        """世界坐标直接变换到屏幕坐标（不做裁剪），等价于依次调用TransformWorldToCamera、
+        TransformCameraToPerspective和TransformPerspectiveToScreen
+        """
+        self.TransformWorldToClip(camera)
+        self.TransformClipToScreen()
+
+    def __GetEnabledVertices(self):
+        return [v for poly in self.polyList if poly.IsEnabled() for v in poly.tvList]
+
     def TransformCameraToPerspective(self, camera):
         """相机坐标变换到透视坐标"""
         for poly in self.polyList:
@@ -291,8 +733,10 @@ class RenderList(object):
                 vertex.pos.y = beta - beta * vertex.pos.y
 
     def CheckBackFace(self, camera):
-        """检测所有多边形的背面，以进行背面消除"""
+        """检测所有多边形的背面，以进行背面消除，加入时已在局部坐标中剔除过背面的多边形直接跳过"""
         for poly in self.polyList:
+            if poly.state & EPolyState.FrontFace:
+                continue
             poly.Clear(EPolyState.Active)
 
             normal = poly.GetNormal()
@@ -300,67 +744,165 @@ class RenderList(object):
             if Vector4.Dot(v, normal) <= 0:
                 poly.SetBit(EPolyState.BackFace)
 
-    def Sort(self):
-        """简单的Z排序（画家算法），注意当多边形很长或互相贯通的时候，这种算法并不准确"""
+    def Sort(self, incremental=False):
+        """简单的Z排序（画家算法），注意当多边形很长或互相贯通的时候，这种算法并不准确
+        所有多边形的深度一次性取出，按排序方式算出键后量化成16位整数（最远的为0），
+        numpy对16位整数的稳定排序是基数排序，复杂度为O(n)；量化后相等的多边形保持原来的先后顺序。
+        incremental为True时（相机和物体与上一帧相比变化很小），如果多边形数量与上一帧相同，先按上一帧的顺序排列，
+        仍然有序就直接使用，否则从这个顺序开始再排一次，量化后相等的多边形沿用上一帧的先后顺序
+        """
+        if self.sortPolyMethod == ESortPolyMethod.Null or not self.polyList:
+            self.__sortOrder = None
+            return
+
+        tvLists = [poly.tvList for poly in self.polyList]
         if self.sortPolyMethod == ESortPolyMethod.AverageZ:
-            self.polyList.sort(key=lambda p: (p.tvList[0].pos.z + p.tvList[1].pos.z + p.tvList[2].pos.z) / 3, reverse=True)
-        elif self.sortPolyMethod == ESortPolyMethod.NearZ:
-            self.polyList.sort(key=lambda p: min(p.tvList[0].pos.z, p.tvList[1].pos.z, p.tvList[2].pos.z), reverse=True)
-        elif self.sortPolyMethod == ESortPolyMethod.FarZ:
-            self.polyList.sort(key=lambda p: max(p.tvList[0].pos.z, p.tvList[1].pos.z, p.tvList[2].pos.z), reverse=True)
+            # 平均值与三个顶点的和只差一个常数因子，量化时会被消去
+            keys = np.array([tvList[0].pos.z + tvList[1].pos.z + tvList[2].pos.z for tvList in tvLists],
+                            dtype=np.float64)
+        else:
+            depths = np.array([[tvList[i].pos.z for tvList in tvLists] for i in range(3)], dtype=np.float64)
+            keys = depths.min(axis=0) if self.sortPolyMethod == ESortPolyMethod.NearZ else depths.max(axis=0)
+        farZ = keys.max()
+        depthRange = farZ - keys.min()
+        scale = np.iinfo(np.uint16).max / depthRange if depthRange > 0 else 0
+        keys = np.rint((farZ - keys) * scale).astype(np.uint16)
+
+        order = self.__sortOrder
+        if not incremental or order is None or len(order) != len(keys):
+            order = np.argsort(keys, kind='stable')
+        else:
+            sortedKeys = keys[order]
+            if (sortedKeys[1:] < sortedKeys[:-1]).any():
+                order = order[np.argsort(sortedKeys, kind='stable')]
+        self.__sortOrder = order
+        self.polyList[:] = [self.polyList[i] for i in order.tolist()]
 
     def RenderWire(self):
-        """渲染线框"""
-        for poly in self.polyList:
-            if not poly.IsEnabled():
-                continue
+        """渲染线框
+        画线的结果与方向有关（起点和增量分别取整），所以每条边先统一端点的顺序：有顶点索引时索引小的顶点为起点，
+        没有时按(y, x)较小的端点为起点，这样同一条边不论来自哪个多边形都画出相同的像素。
+        重复的边只画一次：以（物体序号，较小索引，较大索引）作为边的键去重，保留最后一次出现的边，
+        这样覆盖顺序（颜色）与逐条绘制时相同。所有边最后一次性提交给光栅化器批量裁剪和绘制
+        """
+        polys = [poly for poly in self.polyList if poly.IsEnabled()]
+        if not polys:
+            return
 
-            v0 = poly.tvList[0]
-            v1 = poly.tvList[1]
-            v2 = poly.tvList[2]
-            self.rasterizer.DrawLine(Point(v0.pos.x, v0.pos.y), Point(v1.pos.x, v1.pos.y), poly.material.color)
-            self.rasterizer.DrawLine(Point(v1.pos.x, v1.pos.y), Point(v2.pos.x, v2.pos.y), poly.material.color)
-            self.rasterizer.DrawLine(Point(v2.pos.x, v2.pos.y), Point(v0.pos.x, v0.pos.y), poly.material.color)
+        positions = np.array([[(v.pos.x, v.pos.y) for v in poly.tvList[:3]] for poly in polys], dtype=np.float64)
+        colors = np.array([poly.material.color.tuple for poly in polys], dtype=np.float64)
+        indices = np.array([poly.vIndexList[:3] if poly.objectIndex >= 0 else (-1, -1, -1) for poly in polys],
+                           dtype=np.int64)
+        objectIndices = np.array([poly.objectIndex for poly in polys], dtype=np.int64)
+
+        # 每个多边形的三条边：0->1、1->2、2->0
+        starts = positions.reshape(-1, 2)
+        ends = positions[:, [1, 2, 0]].reshape(-1, 2)
+        edgeColors = np.repeat(colors, 3, axis=0)
+        i, j = indices.reshape(-1), indices[:, [1, 2, 0]].reshape(-1)
+        edgeObjects = np.repeat(objectIndices, 3)
+        noIndex = edgeObjects < 0
+
+        # 统一端点顺序
+        swapByPosition = (starts[:, 1] > ends[:, 1]) | (starts[:, 1] == ends[:, 1]) & (starts[:, 0] > ends[:, 0])
+        swap = np.where(noIndex, swapByPosition, i > j)
+        starts, ends = np.where(swap[:, None], ends, starts), np.where(swap[:, None], starts, ends)
+
+        # 没有顶点索引的多边形用负的边序号作为键，保证不会与其它边合并
+        edgeNumbers = -1 - np.arange(len(i))
+        keys = np.stack((edgeObjects, np.where(noIndex, edgeNumbers, np.minimum(i, j)),
+                         np.where(noIndex, edgeNumbers, np.maximum(i, j))), axis=1)
+        # 反转后取第一次出现的位置，即原顺序中最后一次出现的边
+        _, lastIndex = np.unique(keys[::-1], axis=0, return_index=True)
+        order = np.sort(len(keys) - 1 - lastIndex)
+
+        self.rasterizer.DrawLines(starts[order], ends[order], edgeColors[order])
 
     def CalculateLighting(self, lightList):
-        """计算光照"""
+        """计算光照
+        恒定着色的多边形（多边形法线和第一个顶点）和Gouraud着色的多边形（每个顶点）整理成一个批次，
+        每个光源对整个批次一次性计算，最后统一截断到255。
+        Gouraud着色时同一物体的同一顶点（材质颜色也相同）在一帧内只计算一次，结果缓存起来给所有共享它的多边形使用；
+        渲染列表Reset或者光源状态改变时缓存失效
+        """
+        lightingState = [light.GetState() for light in lightList]
+        if lightingState != self.__lightingState:
+            self.__vertexLightingCache.clear()
+            self.__lightingState = lightingState
+        cache = self.__vertexLightingCache
+        # 本次需要计算的顶点在批次中的行号
+        rowDict = {}
+        normals, positions, baseColors, targets, keys = [], [], [], [], []
         for poly in self.polyList:
             if (not poly.IsEnabled()) or (not poly.material.CanBeShaded()):
                 continue
 
             log.logger.debug('Poly material: {}'.format(poly.material.mode))
+            baseColor = poly.material.color
             # 固定着色
             if poly.material.mode == EMaterialShadeMode.Constant:
                 for v in poly.tvList:
-                    v.color = poly.material.color
+                    v.color = baseColor
             # 恒定着色
             elif poly.material.mode == EMaterialShadeMode.Flat:
-                resultColor = Color()
-                for light in lightList:
-                    light.Calculate(resultColor, poly)
-                for v in poly.tvList:
-                    v.color = resultColor
+                normal, pos = poly.GetNormal(), poly.tvList[0].pos
+                normals.append((normal.x, normal.y, normal.z))
+                positions.append((pos.x, pos.y, pos.z))
+                baseColors.append((baseColor.r, baseColor.g, baseColor.b))
+                targets.append(poly.tvList)
+                keys.append(None)
             # Gouraud着色（分别对每个顶点计算并着色）
             elif poly.material.mode == EMaterialShadeMode.Gouraud:
-                resultColor = [Color(), Color(), Color()]
-                for light in lightList:
-                    light.Calculate(resultColor, poly)
-                for i in range(3):
-                    poly.tvList[i].color = resultColor[i]
+                rgb = (baseColor.r, baseColor.g, baseColor.b)
+                for i, v in enumerate(poly.tvList[:3]):
+                    key = None
+                    if poly.objectIndex >= 0:
+                        key = (poly.objectIndex, poly.vIndexList[i], rgb)
+                        if key in cache:
+                            v.color = cache[key]
+                            continue
+                        if key in rowDict:
+                            targets[rowDict[key]].append(v)
+                            continue
+                        rowDict[key] = len(targets)
+                    normals.append((v.normal.x, v.normal.y, v.normal.z))
+                    positions.append((v.pos.x, v.pos.y, v.pos.z))
+                    baseColors.append(rgb)
+                    targets.append([v])
+                    keys.append(key)
+        if not targets:
+            return
+
+        normals = np.array(normals, dtype=np.float64)
+        positions = np.array(positions, dtype=np.float64)
+        baseColors = np.array(baseColors, dtype=np.float64)
+        resultColors = np.zeros((len(targets), 3), dtype=np.float64)
+        for light in lightList:
+            light.CalculateBatch(resultColors, normals, positions, baseColors)
+        resultColors = np.minimum(resultColors, 255)
+        for vertices, key, (r, g, b) in zip(targets, keys, resultColors.tolist()):
+            resultColor = Color(r, g, b)
+            for v in vertices:
+                v.color = resultColor
+            if key is not None:
+                cache[key] = resultColor
 
     def ClipPoly(self, camera):
-        """裁剪多边形"""
+        """在齐次屏幕坐标中裁剪多边形（TransformWorldToClip之后、TransformClipToScreen之前）
+        视野内的点满足0 <= x / w <= 2 * alpha、0 <= y / w <= 2 * beta，两边乘以w（相机空间的z）后都是线性判断；
+        近裁剪面为w = nearClipZ，交点的位置、纹理坐标和颜色都在齐次坐标中线性插值
+        """
+        xMax = camera.viewportWidth - 1
+        yMax = camera.viewportHeight - 1
         for poly in self.polyList:
             if not poly.IsEnabled():
                 continue
 
-            tanHalfFOV = math.tan(math.radians(camera.fieldOfView / 2))
             # 根据左右裁剪面进行剔除（不需裁剪）
             for v in poly.tvList:
-                zTest = v.pos.z * tanHalfFOV
-                if v.pos.x > zTest:
+                if v.pos.x > xMax * v.pos.w:
                     v.clipCode = EVertexClipCode.LargerThanXMax
-                elif v.pos.x < -zTest:
+                elif v.pos.x < 0:
                     v.clipCode = EVertexClipCode.LessThanXMin
                 else:
                     v.clipCode = EVertexClipCode.BetweenXMinAndXMax
@@ -369,12 +911,11 @@ class RenderList(object):
                 poly.SetBit(EPolyState.Clipped)
                 continue
 
-            # 根据上下裁剪面进行剔除（不需裁剪）
+            # 根据上下裁剪面进行剔除（不需裁剪），屏幕的y轴向下
             for v in poly.tvList:
-                zTest = v.pos.z * tanHalfFOV
-                if v.pos.y > zTest:
+                if v.pos.y < 0:
                     v.clipCode = EVertexClipCode.LargerThanYMax
-                elif v.pos.y < -zTest:
+                elif v.pos.y > yMax * v.pos.w:
                     v.clipCode = EVertexClipCode.LessThanYMin
                 else:
                     v.clipCode = EVertexClipCode.BetweenYMinAndYMax
@@ -386,9 +927,9 @@ class RenderList(object):
             # 根据远裁剪面进行剔除（不需裁剪）
             numVertexInField = 0
             for v in poly.tvList:
-                if v.pos.z > camera.farClipZ:
+                if v.pos.w > camera.farClipZ:
                     v.clipCode = EVertexClipCode.LargerThanZMax
-                elif v.pos.z < camera.nearClipZ:
+                elif v.pos.w < camera.nearClipZ:
                     v.clipCode = EVertexClipCode.LessThanZMin
                 else:
                     v.clipCode = EVertexClipCode.BetweenZMinAndZMax
@@ -399,34 +940,19 @@ class RenderList(object):
                 continue
 
             # 根据近裁剪面进行裁剪
-            # 注意：裁剪多边形发生在顶点着色之前，所以不需要对颜色值进行裁剪
             if any(v.clipCode == EVertexClipCode.LessThanZMin for v in poly.tvList):
-                # 简单情形：1个顶点在视锥体内，2个顶点在近剪裁面外
+                # 顶点位置被改写，不再与物体的顶点对应
+                poly.objectIndex = -1
+                # 简单情形：1个顶点在视锥体内，2个顶点在近剪裁面外，把两个外部顶点移到与近裁剪面的交点上
                 if numVertexInField == 1:
-                    # 第1步：找出视锥体内外的顶点
                     vIn, vOut = None, []
                     for v in poly.tvList:
                         if v.clipCode == EVertexClipCode.BetweenZMinAndZMax:
                             vIn = v
                         else:
                             vOut.append(v)
-
-                    # 求解两个外部顶点应该裁剪到的目标点
                     for v in vOut:
-                        line = v.pos - vIn.pos
-                        t1Solution = (camera.nearClipZ - vIn.pos.z) / line.z
-                        x1Solution = vIn.pos.x + line.x * t1Solution
-                        y1Solution = vIn.pos.y + line.y * t1Solution
-                        # 将解得的值覆盖原来的顶点
-                        v.pos.x = x1Solution
-                        v.pos.y = y1Solution
-                        v.pos.z = camera.nearClipZ
-                        # 裁剪纹理
-                        if poly.material.texture:
-                            uSolution = vIn.textureCoord.x + (v.textureCoord.x - vIn.textureCoord.x) * t1Solution
-                            vSolution = vIn.textureCoord.y + (v.textureCoord.y - vIn.textureCoord.y) * t1Solution
-                            v.textureCoord.x = uSolution
-                            v.textureCoord.y = vSolution
+                        self.__ClipEdge(v, vIn, v, camera.nearClipZ)
                 # 复杂情形：2个顶点在视锥体内，裁剪后是一个四边形，需要再分割出一个三角形
                 elif numVertexInField == 2:
                     vIn, vOut = [], None
@@ -436,74 +962,82 @@ class RenderList(object):
                         else:
                             vOut = v
 
-                    line1 = vIn[0].pos - vOut.pos
-                    t1Solution = (camera.nearClipZ - vOut.pos.z) / line1.z
-                    x1Solution = vOut.pos.x + line1.x * t1Solution
-                    y1Solution = vOut.pos.y + line1.y * t1Solution
-
-                    line2 = vIn[1].pos - vOut.pos
-                    t2Solution = (camera.nearClipZ - vOut.pos.z) / line2.z
-                    x2Solution = vOut.pos.x + line2.x * t2Solution
-                    y2Solution = vOut.pos.y + line2.y * t2Solution
-
-                    # 裁剪纹理
-                    if poly.material.texture:
-                        u1Solution = vIn[0].textureCoord.x + (vIn[0].textureCoord.x - vOut.textureCoord.x) * t1Solution
-                        v1Solution = vIn[0].textureCoord.y + (vIn[0].textureCoord.y - vOut.textureCoord.y) * t1Solution
-                        u2Solution = vIn[1].textureCoord.x + (vIn[1].textureCoord.x - vOut.textureCoord.x) * t2Solution
-                        v2Solution = vIn[1].textureCoord.y + (vIn[1].textureCoord.y - vOut.textureCoord.y) * t2Solution
-
-                    # 将解得的值覆盖原来的外部的顶点
-                    vOut.pos.x = x1Solution
-                    vOut.pos.y = y1Solution
-                    vOut.pos.z = camera.nearClipZ
-                    if poly.material.texture:
-                        vOut.textureCoord.x = u1Solution
-                        vOut.textureCoord.y = v1Solution
-
-                    # 创建新的三角形
-                    newV1 = copy.deepcopy(vIn[1])
-                    newV2 = copy.deepcopy(vOut)
-                    # WARNING: 这里顶点的法线直接用的多边形法线，但应该是不准确的
-                    polyNormal = poly.GetNormal()
-                    newV3 = Vertex(pos=Vector4(x2Solution, y2Solution, camera.nearClipZ),
-                                   normal=Vector4(polyNormal.x, polyNormal.y, polyNormal.z),
-                                   color=Color(vOut.color.r, vOut.color.g, vOut.color.b, vOut.color.a))
-                    if poly.material.texture:
-                        newV3.SetTextureCorrd(Point(u2Solution, v2Solution))
-                    # newPoly = copy.deepcopy(poly)
-                    newPoly = Poly()
-                    newPoly.AddVertexWithoutIndex(newV1, newV1.textureCoord)
-                    newPoly.AddVertexWithoutIndex(newV3, newV3.textureCoord)
-                    newPoly.AddVertexWithoutIndex(newV2, newV2.textureCoord)
+                    # 新的三角形由内部顶点vIn[1]、第二条边的交点和第一条边的交点组成
+                    newPoly = self.__AllocatePoly(poly.material)
+                    newV1, newV3, newV2 = newPoly.tvList
+                    self.__CopyVertex(newV1, vIn[1])
+                    self.__CopyVertex(newV3, vOut)
+                    self.__ClipEdge(newV3, vIn[1], vOut, camera.nearClipZ)
+                    # 把外部的顶点移到第一条边的交点上
+                    self.__ClipEdge(vOut, vIn[0], vOut, camera.nearClipZ)
+                    self.__CopyVertex(newV2, vOut)
                     self.polyList.append(newPoly)
 
+    @staticmethod
+    def __CopyVertex(v, source):
+        RenderList.__SetVertex(v, source.pos, source.normal.vector, (source.textureCoord.x, source.textureCoord.y),
+                               source.color)
+
+    @staticmethod
+    def __ClipEdge(result, vIn, vOut, nearClipZ):
+        """求边vIn-vOut与近裁剪面w = nearClipZ的交点，把位置、纹理坐标和颜色写入顶点result"""
+        t = (nearClipZ - vIn.pos.w) / (vOut.pos.w - vIn.pos.w)
+        p1, p2 = vIn.pos, vOut.pos
+        result.pos = Vector4(p1.x + (p2.x - p1.x) * t, p1.y + (p2.y - p1.y) * t, p1.z + (p2.z - p1.z) * t, nearClipZ)
+        result.textureCoord = Point.Lerp(vIn.textureCoord, vOut.textureCoord, t)
+        result.color = Color.Lerp(vIn.color, vOut.color, t)
+
+    def EnableParallelRender(self, numProcesses=None):
+        """开启多进程分块并行渲染（numProcesses默认为CPU核数），只影响RenderSolid"""
+        self.DisableParallelRender()
+        self.parallelRasterizer = ParallelRasterizer(self.rasterizer, numProcesses)
+
+    def DisableParallelRender(self):
+        """关闭多进程渲染并释放进程池和共享内存"""
+        if self.parallelRasterizer:
+            self.parallelRasterizer.Close()
+            self.parallelRasterizer = None
+
     def RenderSolid(self):
+        """渲染实体多边形
+        把所有可见多边形整理成按三角形组织的数组，一次性提交给光栅器，避免为每个三角形创建Point对象
+        """
+        positions, invZ, colors, uvs, materialIds = [], [], [], [], []
+        materials, materialIndexDict = [], {}
         for poly in self.polyList:
             if not poly.IsEnabled():
                 continue
 
-            v0 = poly.tvList[0]
-            v1 = poly.tvList[1]
-            v2 = poly.tvList[2]
-            if not poly.material.texture:
-                self.rasterizer.DrawTriangle(Point.FromVertex(v0),
-                                             Point.FromVertex(v1),
-                                             Point.FromVertex(v2))
-            else:
-                self.rasterizer.DrawTriangle(UVPoint(v0.pos.x, v0.pos.y, v0.pos.z, v0.color, v0.textureCoord.x, v0.textureCoord.y, poly.material),
-                                             UVPoint(v1.pos.x, v1.pos.y, v1.pos.z, v1.color, v1.textureCoord.x, v1.textureCoord.y, poly.material),
-                                             UVPoint(v2.pos.x, v2.pos.y, v2.pos.z, v2.color, v2.textureCoord.x, v2.textureCoord.y, poly.material))
+            material = poly.material
+            materialIndex = materialIndexDict.get(id(material))
+            if materialIndex is None:
+                materialIndex = materialIndexDict[id(material)] = len(materials)
+                materials.append(material)
+            materialIds.append(materialIndex)
+            for v in poly.tvList:
+                positions.append((v.pos.x, v.pos.y))
+                invZ.append(1 / v.pos.z)
+                colors.append((v.color.r, v.color.g, v.color.b, v.color.a))
+                uvs.append((v.textureCoord.x, v.textureCoord.y))
 
-    def PreRender(self, camera, lightList):
+        numPolys = len(materialIds)
+        if numPolys == 0:
+            return
+        rasterizer = self.parallelRasterizer or self.rasterizer
+        rasterizer.DrawTriangles(np.array(positions, dtype=np.float64).reshape(numPolys, 3, 2),
+                                 np.array(invZ, dtype=np.float64).reshape(numPolys, 3),
+                                 np.array(colors, dtype=np.float64).reshape(numPolys, 3, 4),
+                                 np.array(uvs, dtype=np.float64).reshape(numPolys, 3, 2),
+                                 materialIds, materials)
+
+    def PreRender(self, camera, lightList, incrementalSort=False):
         self.CheckBackFace(camera)
-        # TODO 这里实际上也要把光源也变换到相机空间
-        self.TransformWorldToCamera(camera)
-        self.ClipPoly(camera)
+        # 光源和顶点都在世界坐标中，先计算光照，裁剪时再对颜色插值
         self.CalculateLighting(lightList)
-        self.Sort()
-        self.TransformCameraToPerspective(camera)
-        self.TransformPerspectiveToScreen(camera)
+        self.TransformWorldToClip(camera)
+        self.ClipPoly(camera)
+        self.Sort(incrementalSort)
+        self.TransformClipToScreen()
 
 
 # endregion
@@ -1,17 +1,72 @@
 #!/usr/bin/env python3
 
+import os
 import math
+import atexit
+import collections
+from enum import Enum
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
 from PIL import Image
 import utils.log as log
-from graphics.base import ETextureFilterMode
 from lib.math3d import *
+from graphics.base import Material
+from graphics.texture import Texture
+
+
+class ERasterizeMode(Enum):
+    """三角形光栅化方式"""
+    # 分割成平顶和平底三角形，逐条扫描线填充
+    Scanline = 0
+    # 按屏幕分块计算边函数，整块接受或丢弃
+    Tile = 1
+    # 顶点坐标对齐到1 / 2^SubPixelBits像素的整数网格，逐行用整数边函数求出每条扫描线的覆盖区间（严格的左上填充规则）
+    SubPixel = 2
+
+
+class EInterpolationMode(Enum):
+    """扫描线（无纹理）的颜色和深度插值方式"""
+    # 浮点插值
+    Float = 0
+    # 定点整数插值：颜色和1/z转换成定点整数后按整数步进，颜色以打包的32位RGBA写入，结果与平台的浮点误差累积无关
+    FixedPoint = 1
+
+
+class ETextureMappingMode(Enum):
+    """扫描线纹理映射方式"""
+    # 每个像素都做透视除法，结果精确
+    Perspective = 0
+    # 每隔AffineSpanLength个像素做一次精确的透视除法，中间线性插值（误差随间隔和间隔内深度的变化增大，在分段端点上为0）
+    SubdividedAffine = 1
+
+
+# 分块和子像素光栅化的三角形设置（每个字段都是按三角形组织的数组）
+TriangleSetup = collections.namedtuple('TriangleSetup', ['x0', 'y0', 'edgeA', 'edgeB', 'edgeC', 'topLeft', 'area',
+                                                         'bounds', 'nearestInvZ', 'attr0', 'dadx', 'dady'])
 
 
 class Rasterizer(object):
-    def __init__(self, buffer, zbuffer=None):
+    # 分块光栅化时块的边长（像素）
+    TileSize = 8
+    # 分段仿射纹理映射时每段的像素数
+    AffineSpanLength = 16
+    # 定点插值时颜色和1/z的小数位数
+    ColorFractionBits = 16
+    DepthFractionBits = 40
+    # 子像素光栅化时顶点坐标的小数位数
+    SubPixelBits = 4
+
+    def __init__(self, buffer, zbuffer=None, rasterizeMode=ERasterizeMode.Scanline,
+                 textureMappingMode=ETextureMappingMode.Perspective, interpolationMode=EInterpolationMode.Float):
         self.buffer = buffer
         self.clipRegion = [Point(0, 0), Point(buffer.width, buffer.height)]
         self.zbuffer = zbuffer
+        self.rasterizeMode = rasterizeMode
+        # 只影响扫描线方式的纹理映射，分块和子像素方式总是逐像素做透视除法
+        self.textureMappingMode = textureMappingMode
+        # 只影响扫描线方式的无纹理三角形
+        self.interpolationMode = interpolationMode
 
     def DrawLine(self, p1, p2, color):
         """
@@ -57,6 +112,65 @@ class Rasterizer(object):
                 error += dx2
                 currY += yInc
 
+    def DrawLines(self, starts, ends, colors):
+        """批量画线，starts、ends为N*2的端点坐标，colors为N*4的RGBA颜色
+        逐像素结果与DrawLine（Bresenahams算法）相同：对第k步，主方向坐标为起点加k，
+        副方向坐标为起点加floor((2k * |d副| + |d主|) / (2|d主|))，因此所有线段的所有像素可以一次性用数组算出。
+        光栅化之前先把每条线段的步数范围裁剪到裁剪区域内，只生成可能落在区域内的像素
+        """
+        starts = np.asarray(starts, dtype=np.float64)
+        ends = np.asarray(ends, dtype=np.float64)
+        colors = np.asarray(colors, dtype=np.float64)
+        if len(starts) == 0:
+            return
+
+        # 与DrawLine一致：起点和增量分别取整
+        x0, y0 = np.rint(starts[:, 0]).astype(np.int64), np.rint(starts[:, 1]).astype(np.int64)
+        dx = np.rint(ends[:, 0] - starts[:, 0]).astype(np.int64)
+        dy = np.rint(ends[:, 1] - starts[:, 1]).astype(np.int64)
+        adx, ady = np.abs(dx), np.abs(dy)
+        steps = np.maximum(adx, ady)
+
+        # 裁剪：理想直线上第k步的点与实际像素的距离小于1，所以只保留理想点落在向外扩1个像素的裁剪区域内的步数
+        clipX1 = max(0, math.ceil(self.clipRegion[0].x))
+        clipY1 = max(0, math.ceil(self.clipRegion[0].y))
+        clipX2 = min(self.buffer.width, math.ceil(self.clipRegion[1].x))
+        clipY2 = min(self.buffer.height, math.ceil(self.clipRegion[1].y))
+        kMin = np.zeros(len(steps), dtype=np.float64)
+        kMax = steps.astype(np.float64)
+        safeSteps = np.maximum(steps, 1)
+        for origin, delta, low, high in ((x0, dx, clipX1 - 1, clipX2), (y0, dy, clipY1 - 1, clipY2)):
+            slope = delta / safeSteps
+            with np.errstate(divide='ignore', invalid='ignore'):
+                k1 = (low - origin) / slope
+                k2 = (high - origin) / slope
+            moving = slope != 0
+            kMin = np.where(moving, np.maximum(kMin, np.minimum(k1, k2)), kMin)
+            kMax = np.where(moving, np.minimum(kMax, np.maximum(k1, k2)), kMax)
+            # 与坐标轴平行且在区域外的线段整条丢弃
+            kMax = np.where(~moving & ((origin < low) | (origin > high)), -1, kMax)
+        kStart = np.clip(np.ceil(kMin), 0, steps).astype(np.int64)
+        kEnd = np.clip(np.floor(kMax) + 1, 0, steps).astype(np.int64)
+        counts = np.maximum(kEnd - kStart, 0)
+        total = int(counts.sum())
+        if total == 0:
+            return
+
+        # 展开所有线段裁剪后的步数
+        line = np.repeat(np.arange(len(steps)), counts)
+        k = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts) + kStart[line]
+        ax, ay = adx[line], ady[line]
+        sx, sy = np.where(dx[line] >= 0, 1, -1), np.where(dy[line] >= 0, 1, -1)
+        xMajor = ax > ay
+        major = np.where(xMajor, ax, ay)
+        minor = np.where(xMajor, ay, ax)
+        minorOffset = (2 * k * minor + major) // (2 * major)
+        xs = x0[line] + sx * np.where(xMajor, k, minorOffset)
+        ys = y0[line] + sy * np.where(xMajor, minorOffset, k)
+
+        inside = (xs >= clipX1) & (xs < clipX2) & (ys >= clipY1) & (ys < clipY2)
+        self.buffer.SetPixels(xs[inside], ys[inside], colors[line[inside]])
+
     def DrawRectangle(self, p1, p2, color):
         """画矩形线框"""
         bottomLeft = Point(p1.x, p2.y)
@@ -72,214 +186,430 @@ class Rasterizer(object):
                         math.isclose(p1.y, p2.y) and math.isclose(p2.y, p3.y):
             return
 
-        # 将三个点按y1 y2 y3排序
-        if p2.y < p1.y:
-            p1, p2 = p2, p1
-        if p3.y < p1.y:
-            p1, p3 = p3, p1
-        if p3.y < p2.y:
-            p2, p3 = p3, p2
+        points = (p1, p2, p3)
+        textured = isinstance(p1, UVPoint)
+        self.DrawTriangles(np.array([[[p.x, p.y] for p in points]], dtype=np.float64),
+                           np.array([[1 / p.z for p in points]], dtype=np.float64),
+                           np.array([[(p.color.r, p.color.g, p.color.b, p.color.a) for p in points]], dtype=np.float64),
+                           np.array([[(p.u, p.v) for p in points]], dtype=np.float64) if textured else None,
+                           [0] if textured else None, [p1.material] if textured else None)
+
+    def DrawTriangles(self, positions, invZ, colors, uvs=None, materialIds=None, materials=None):
+        """批量画三角形
+        参数均为按三角形组织的数组（struct of arrays），N为三角形个数：
+        positions: N*3*2的屏幕坐标，invZ: N*3的1/z，colors: N*3*4的RGBA颜色，
+        uvs: N*3*2的纹理坐标，materialIds: N个材质在materials中的下标（材质带纹理的三角形才做纹理映射）
+        共线三角形和完全在裁剪区域外的三角形被整批剔除，分块光栅化所需的三角形设置也整批完成，
+        剩下的三角形按提交顺序绘制（保证画家算法的顺序）
+        """
+        positions = np.asarray(positions, dtype=np.float64)
+        invZ = np.asarray(invZ, dtype=np.float64)
+        colors = np.asarray(colors, dtype=np.float64)
+        if uvs is not None:
+            uvs = np.asarray(uvs, dtype=np.float64)
+        if len(positions) == 0:
+            return
+        xs, ys = positions[..., 0], positions[..., 1]
 
-        # 测试裁剪
+        # 剔除三点共线的三角形
+        area = (xs[:, 1] - xs[:, 0]) * (ys[:, 2] - ys[:, 0]) - (xs[:, 2] - xs[:, 0]) * (ys[:, 1] - ys[:, 0])
+        keep = np.abs(area) > 1e-9
+        # 剔除完全在裁剪区域外的三角形
         minClipX = self.clipRegion[0].x
         minClipY = self.clipRegion[0].y
         maxClipX = self.clipRegion[1].x
         maxClipY = self.clipRegion[1].y
-        if p3.y < minClipY or p1.y > maxClipY or \
-                                        p1.x < minClipX and p2.x < minClipX and p3.x < minClipX or \
-                                        p1.x > maxClipX and p2.x > maxClipX and p3.x > maxClipX:
+        keep &= (ys.max(axis=1) >= minClipY) & (ys.min(axis=1) <= maxClipY) & \
+                (xs.max(axis=1) >= minClipX) & (xs.min(axis=1) <= maxClipX)
+        indices = np.flatnonzero(keep)
+        if len(indices) == 0:
             return
 
-        if math.isclose(p1.y, p2.y):
-            self.DrawTopFlatTriangle(p1, p2, p3)
-        elif math.isclose(p2.y, p3.y):
-            self.DrawBottomFlatTriangle(p1, p2, p3)
+        # 每个三角形的纹理材质（没有纹理则为None）
+        textureMaterials = [None] * len(indices)
+        if uvs is not None and materials is not None and materialIds is not None:
+            materialIds = np.asarray(materialIds)[indices].tolist()
+            textureMaterials = [materials[m] if materials[m].texture else None for m in materialIds]
+
+        if self.rasterizeMode in (ERasterizeMode.Tile, ERasterizeMode.SubPixel):
+            setup = self.__SetupTriangles(self.__SnapPositions(positions[indices]), invZ[indices], colors[indices],
+                                          uvs[indices] if uvs is not None else None)
+            for k, material in enumerate(textureMaterials):
+                self.__DrawSetupTriangle(setup, k, material)
         else:
-            # 由上面点的排序可知，p1-p3必为长边，在长边上找出分割点的X坐标
-            rate = (p2.y - p1.y) / (p3.y - p1.y)
-            splitX = p1.x + (p3.x - p1.x) * rate
-            splitZ = 1 / (1 / p1.z + (1 / p3.z - 1 / p1.z) * rate)
-            splitColor = Color.Lerp(p1.color, p3.color, rate)
-            if isinstance(p1, UVPoint):
-                splitU = (p1.u / p1.z + (p3.u / p3.z - p1.u / p1.z) * rate) * splitZ
-                splitV = (p1.v / p1.z + (p3.v / p3.z - p1.v / p1.z) * rate) * splitZ
-                splitPoint = UVPoint(splitX, p2.y, splitZ, splitColor,
-                                     splitU, splitV, p1.material)
-            else:
-                splitPoint = Point(splitX, p2.y, splitZ, splitColor)
+            # 扫描线方式的顶点属性为[x, y, 1/z, r, g, b, a]，有纹理时再加上u/z、v/z，整批按y排序后转成列表，
+            # 直接用来建立每条边的起始值和增量，不再为每个三角形创建Point和Color对象
+            attrs = [positions, invZ[..., None], colors]
+            if uvs is not None:
+                attrs.append(uvs * invZ[..., None])
+            attrs = np.concatenate(attrs, axis=2)[indices]
+            order = np.argsort(attrs[..., 1], axis=1, kind='stable')
+            attrs = attrs[np.arange(len(indices))[:, None], order]
+            gradients = [None] * len(indices)
+            if any(textureMaterials):
+                gradX, gradY = self.__GetTextureGradients(attrs[..., :2], attrs[..., [2, 7, 8]])
+                gradients = list(zip(gradX.tolist(), gradY.tolist()))
+            bounds = self.__GetPixelBounds(xs[indices], ys[indices]).tolist()
+            nearestInvZ = invZ[indices].max(axis=1).tolist()
+            for k, (vertices, material) in enumerate(zip(attrs.tolist(), textureMaterials)):
+                if self.__IsTriangleOccluded(bounds[k], nearestInvZ[k]):
+                    continue
+                self.__DrawScanlineTriangle(*vertices, material, gradients[k])
+                self.__UpdateHierarchicalZ(bounds[k])
+
+    def __DrawScanlineTriangle(self, v1, v2, v3, material=None, gradients=None):
+        """将按y排序后的三角形分割成平底和平顶三角形分别绘制
+        顶点为属性列表[x, y, 1/z, r, g, b, a(, u/z, v/z)]，除alpha外都在屏幕空间线性插值
+        """
+        if math.isclose(v1[1], v2[1]):
+            self.__DrawTopFlatTriangle(v1, v2, v3, material, gradients)
+        elif math.isclose(v2[1], v3[1]):
+            self.__DrawBottomFlatTriangle(v1, v2, v3, material, gradients)
+        else:
+            # 由上面点的排序可知，v1-v3必为长边，在长边上插值出分割点
+            rate = (v2[1] - v1[1]) / (v3[1] - v1[1])
+            split = [a + (b - a) * rate for a, b in zip(v1, v3)]
+            split[1] = v2[1]
             # 画被分割的上平底和下平顶三角形
-            self.DrawBottomFlatTriangle(p1, splitPoint, p2)
-            self.DrawTopFlatTriangle(p2, splitPoint, p3)
+            self.__DrawBottomFlatTriangle(v1, split, v2, material, gradients)
+            self.__DrawTopFlatTriangle(v2, split, v3, material, gradients)
 
-    def DrawBottomFlatTriangle(self, p1, p2, p3):
-        """画平底三角形
-        假定平底的两个顶点为v2和v3，上顶点为v1
+    def __SnapPositions(self, positions):
+        """子像素方式下把顶点坐标对齐到1 / 2^SubPixelBits像素的网格上，其他方式原样返回
+        对齐后的坐标乘以2^SubPixelBits是整数，边函数的系数都可以用整数精确表示
         """
+        if self.rasterizeMode != ERasterizeMode.SubPixel:
+            return positions
+        scale = 1 << self.SubPixelBits
+        return np.rint(positions * scale) / scale
+
+    def __DrawSetupTriangle(self, setup, i, material=None):
+        if self.rasterizeMode == ERasterizeMode.SubPixel:
+            self.__DrawSubPixelTriangle(setup, i, material)
+        else:
+            self.__DrawTileTriangle(setup, i, material)
 
-        def __Init(_p1, _p2, _p3):
-            # 确保x2在左，x3在右
-            if _p3.x < _p2.x:
-                _p2, _p3 = _p3, _p2
-
-            dy = _p3.y - _p1.y
-            dxLeft = (_p2.x - _p1.x) / dy
-            dxRight = (_p3.x - _p1.x) / dy
-
-            iz1, iz2, iz3 = 1 / _p1.z, 1 / _p2.z, 1 / _p3.z
-            dizLeft = (iz2 - iz1) / dy
-            dizRight = (iz3 - iz1) / dy
-            dcLeft = (_p2.color - _p1.color) / dy
-            dcRight = (_p3.color - _p1.color) / dy
-            xs = xe = _p1.x
-            izs = ize = iz1
-            cs = ce = _p1.color
-            log.logger.debug('bottom flat: {}\n{}\n{}\n'.format(p1, p2, p3))
-            if isinstance(_p1, UVPoint):
-                iu1, iv1 = _p1.u / _p1.z, _p1.v / _p1.z
-                iu2, iv2 = _p2.u / _p2.z, _p2.v / _p2.z
-                iu3, iv3 = _p3.u / _p3.z, _p3.v / _p3.z
-                ts = [iu1, iv1]
-                te = [iu1, iv1]
-                dtLeft = ((iu2 - iu1) / dy, (iv2 - iv1) / dy)
-                dtRight = ((iu3 - iu1) / dy, (iv3 - iv1) / dy)
-                return (xs, xe, dxLeft, dxRight), (cs, ce, dcLeft, dcRight), (izs, ize, dizLeft, dizRight), (ts, te, dtLeft, dtRight)
+    def __SetupTriangles(self, positions, invZ, colors, uvs=None):
+        """整批计算分块光栅化所需的三角形设置：边函数、左上填充规则、包围盒以及属性的平面方程
+        属性依次为1/z、RGBA颜色，有uv时再加上u/z和v/z
+        """
+        px, py = positions[..., 0], positions[..., 1]
+
+        # 三条边的边函数E(x, y) = A * x + B * y + C，第i条边为第i个顶点的对边
+        a, b = [1, 2, 0], [2, 0, 1]
+        edgeA = py[:, a] - py[:, b]
+        edgeB = px[:, b] - px[:, a]
+        edgeC = px[:, a] * py[:, b] - py[:, a] * px[:, b]
+        # 统一边函数的方向，使三角形内部为正
+        area = edgeA[:, 0] * px[:, 0] + edgeB[:, 0] * py[:, 0] + edgeC[:, 0]
+        sign = np.where(area < 0, -1.0, 1.0)[:, None]
+        edgeA, edgeB, edgeC = edgeA * sign, edgeB * sign, edgeC * sign
+        # 左上填充规则：只有左边和上边包含恰好落在边上的像素
+        topLeft = (edgeA > 0) | ((edgeA == 0) & (edgeB > 0))
+
+        bounds = self.__GetPixelBounds(px, py)
+
+        # 属性的平面方程：attr(x, y) = attr0 + dadx * (x - x0) + dady * (y - y0)
+        attrs = [invZ[..., None], colors]
+        if uvs is not None:
+            attrs.append(uvs * invZ[..., None])
+        attrs = np.concatenate(attrs, axis=2)
+        dx1, dy1 = (px[:, 1] - px[:, 0])[:, None], (py[:, 1] - py[:, 0])[:, None]
+        dx2, dy2 = (px[:, 2] - px[:, 0])[:, None], (py[:, 2] - py[:, 0])[:, None]
+        det = dx1 * dy2 - dx2 * dy1
+        det[det == 0] = 1
+        da1, da2 = attrs[:, 1] - attrs[:, 0], attrs[:, 2] - attrs[:, 0]
+        dadx = (da1 * dy2 - da2 * dy1) / det
+        dady = (da2 * dx1 - da1 * dx2) / det
+
+        return TriangleSetup(px[:, 0], py[:, 0], edgeA, edgeB, edgeC, topLeft, np.abs(area), bounds,
+                             invZ.max(axis=1), attrs[:, 0], dadx, dady)
+
+    def __GetPixelBounds(self, px, py):
+        """计算一批三角形（px、py为N*3的顶点坐标）覆盖的像素包围盒[x1, x2)*[y1, y2)，并与裁剪区域求交
+        与扫描线方式一致，像素x的覆盖测试点为(x + 0.5, y)
+        """
+        clipX1 = max(0, math.ceil(self.clipRegion[0].x))
+        clipY1 = max(0, math.ceil(self.clipRegion[0].y))
+        clipX2 = min(self.buffer.width, math.ceil(self.clipRegion[1].x))
+        clipY2 = min(self.buffer.height, math.ceil(self.clipRegion[1].y))
+        bounds = np.empty((len(px), 4), dtype=np.int64)
+        bounds[:, 0] = np.maximum(np.ceil(px.min(axis=1) - 0.5), clipX1)
+        bounds[:, 1] = np.maximum(np.ceil(py.min(axis=1)), clipY1)
+        bounds[:, 2] = np.minimum(np.floor(px.max(axis=1) - 0.5) + 1, clipX2)
+        bounds[:, 3] = np.minimum(np.floor(py.max(axis=1)) + 1, clipY2)
+        return bounds
+
+    def __IsTriangleOccluded(self, bounds, nearestInvZ):
+        """用分层Z缓存判断整个三角形是否被遮挡
+        1/z在屏幕空间是线性的，三角形最近的深度就是三个顶点中最大的1/z
+        """
+        if not isinstance(self.zbuffer, HierarchicalZBuffer):
+            return False
+        x1, y1, x2, y2 = bounds
+        if x1 >= x2 or y1 >= y2:
+            return True
+        return self.zbuffer.IsOccluded(x1, y1, x2, y2, nearestInvZ)
+
+    def __UpdateHierarchicalZ(self, bounds):
+        """画完三角形后更新它覆盖的分层Z缓存的块"""
+        if isinstance(self.zbuffer, HierarchicalZBuffer):
+            self.zbuffer.UpdateTiles(*bounds)
+
+    def __DrawTileTriangle(self, setup, i, material=None):
+        """用边函数（重心坐标）按屏幕分块光栅化setup中的第i个三角形
+        以TileSize*TileSize的块为单位，先用块的角点判断整块在三角形外（整块丢弃）或整块在三角形内（整块接受），
+        只有跨越三角形边的块才逐像素计算边函数。与扫描线方式一致，像素x的覆盖测试点取(x + 0.5, y)，
+        1/z、颜色和uv/z在屏幕空间线性插值，uv再除以1/z做透视矫正；material不为None时做纹理映射
+        """
+        if setup.area[i] < 1e-9:
+            return
+        x1, y1, x2, y2 = setup.bounds[i].tolist()
+        if x1 >= x2 or y1 >= y2:
+            return
+        nearestInvZ = setup.nearestInvZ[i]
+        if self.__IsTriangleOccluded((x1, y1, x2, y2), nearestInvZ):
+            return
+        edgeA, edgeB, edgeC = setup.edgeA[i], setup.edgeB[i], setup.edgeC[i]
+
+        # 计算每个块在每条边上的边函数最小值和最大值（边函数是线性的，极值在块的角点上）
+        tileSize = self.TileSize
+        tileY, tileX = np.mgrid[y1 // tileSize:(y2 - 1) // tileSize + 1, x1 // tileSize:(x2 - 1) // tileSize + 1]
+        tileX = tileX.ravel() * tileSize
+        tileY = tileY.ravel() * tileSize
+        cornerX1 = tileX[:, None] + 0.5
+        cornerX2 = cornerX1 + (tileSize - 1)
+        cornerY1 = tileY[:, None].astype(np.float64)
+        cornerY2 = cornerY1 + (tileSize - 1)
+        edgeMax = edgeA * np.where(edgeA > 0, cornerX2, cornerX1) + edgeB * np.where(edgeB > 0, cornerY2, cornerY1) + edgeC
+        edgeMin = edgeA * np.where(edgeA > 0, cornerX1, cornerX2) + edgeB * np.where(edgeB > 0, cornerY1, cornerY2) + edgeC
+        # 任意一条边的最大值小于0则整块在三角形外；所有边的最小值大于0则整块在三角形内
+        keep = ~(edgeMax < 0).any(axis=1)
+        hzbuffer = self.zbuffer if isinstance(self.zbuffer, HierarchicalZBuffer) else None
+        if hzbuffer and hzbuffer.tileSize == tileSize:
+            # 三角形在块内最近的深度（1/z的平面在块角上的测试点取最大值，且不超过顶点的最大值），
+            # 不比该块在分层Z缓存中最远的深度近时整块丢弃
+            dzdx, dzdy = setup.dadx[i][0], setup.dady[i][0]
+            nearestX = tileX + (tileSize - 0.5 if dzdx > 0 else 0.5)
+            nearestY = tileY + (tileSize - 1 if dzdy > 0 else 0)
+            tileNearest = setup.attr0[i][0] + dzdx * (nearestX - setup.x0[i]) + dzdy * (nearestY - setup.y0[i])
+            tileNearest = np.minimum(tileNearest, nearestInvZ)
+            keep &= tileNearest > hzbuffer.GetTileData()[tileY // tileSize, tileX // tileSize]
+        if not keep.any():
+            return
+        tileX, tileY = tileX[keep], tileY[keep]
+        full = (edgeMin[keep] > 0).all(axis=1)
+
+        # 展开保留下来的块内的所有像素
+        offsetY, offsetX = np.divmod(np.arange(tileSize * tileSize), tileSize)
+        xs = (tileX[:, None] + offsetX).ravel()
+        ys = (tileY[:, None] + offsetY).ravel()
+        full = np.repeat(full, tileSize * tileSize)
+        covered = (xs >= x1) & (xs < x2) & (ys >= y1) & (ys < y2)
+        # 只对跨边的块做逐像素的边函数测试
+        partial = covered & ~full
+        sx, sy = xs[partial] + 0.5, ys[partial]
+        inside = np.ones(len(sx), dtype=bool)
+        topLeft = setup.topLeft[i]
+        for k in range(3):
+            e = edgeA[k] * sx + edgeB[k] * sy + edgeC[k]
+            inside &= (e > 0) | ((e == 0) & topLeft[k])
+        covered[partial] = inside
+        self.__ShadePixels(setup, i, xs[covered], ys[covered], material, (x1, y1, x2, y2))
+
+    def __DrawSubPixelTriangle(self, setup, i, material=None):
+        """用整数边函数逐条扫描线光栅化setup中的第i个三角形（顶点已对齐到子像素网格）
+        坐标以1 / S像素为单位（S = 2^SubPixelBits），像素(x, y)的覆盖测试点为(S * x + S / 2, S * y)，
+        边函数E = A * X + B * Y + C的系数都是整数，换行时E增加B * S，因此每条扫描线上每条边的交点都由整数除法精确求出，
+        不需要对浮点的边界坐标取整。严格的左上填充规则：E > 0，或者E = 0且为左边或上边，
+        相邻三角形的公共边上的像素恰好属于其中一个三角形，既不会画两次也不会留下缝隙
+        """
+        if setup.area[i] < 1e-9:
+            return
+        x1, y1, x2, y2 = setup.bounds[i].tolist()
+        if x1 >= x2 or y1 >= y2:
+            return
+        if self.__IsTriangleOccluded((x1, y1, x2, y2), setup.nearestInvZ[i]):
+            return
+
+        scale = 1 << self.SubPixelBits
+        edgeA = np.rint(setup.edgeA[i] * scale).astype(np.int64)
+        edgeB = np.rint(setup.edgeB[i] * scale).astype(np.int64)
+        edgeC = np.rint(setup.edgeC[i] * scale * scale).astype(np.int64)
+        # 非左上边上的点不算覆盖，即要求E >= 1
+        bias = np.where(setup.topLeft[i], 0, 1)
+
+        # 每条扫描线在像素中心x = 0处的边函数值（减去偏置），整数，逐行增加B * S
+        rows = np.arange(y1, y2, dtype=np.int64)
+        base = (edgeA * (scale // 2) + edgeC - bias) + np.outer(rows, edgeB * scale)
+        # 覆盖条件：A * S * x + base >= 0
+        start = np.full(len(rows), x1, dtype=np.int64)
+        end = np.full(len(rows), x2, dtype=np.int64)
+        for k, a in enumerate(edgeA.tolist()):
+            if a > 0:
+                start = np.maximum(start, -(base[:, k] // (a * scale)))
+            elif a < 0:
+                end = np.minimum(end, base[:, k] // (-a * scale) + 1)
             else:
-                return (xs, xe, dxLeft, dxRight), (cs, ce, dcLeft, dcRight), (izs, ize, dizLeft, dizRight), None
+                end = np.where(base[:, k] >= 0, end, start)
+        counts = np.maximum(end - start, 0)
+        total = int(counts.sum())
+        if total == 0:
+            return
 
-        self.__DrawClipTriangle(p1, p2, p3, __Init)
+        # 展开所有扫描线上的像素
+        row = np.repeat(np.arange(len(rows)), counts)
+        xs = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts) + start[row]
+        ys = rows[row]
+        self.__ShadePixels(setup, i, xs, ys, material, (x1, y1, x2, y2))
+
+    def __ShadePixels(self, setup, i, xs, ys, material, bounds):
+        """对setup中第i个三角形覆盖的像素（xs, ys）插值、采样纹理、做Z缓存测试并写入"""
+        if len(xs) == 0:
+            return
 
-    def DrawTopFlatTriangle(self, p1, p2, p3):
+        # 用平面方程在覆盖测试点(x + 0.5, y)上插值1/z、颜色（以及uv/z）
+        values = setup.attr0[i] + np.outer(xs + 0.5 - setup.x0[i], setup.dadx[i]) + \
+            np.outer(ys - setup.y0[i], setup.dady[i])
+        iz = values[:, 0]
+        colors = values[:, 1:5]
+        if material:
+            textureColors = self.__SampleTexture(material, iz, values[:, 5], values[:, 6],
+                                                 setup.dadx[i][[0, 5, 6]], setup.dady[i][[0, 5, 6]])
+            colors = self.__ModulateTextureColors(textureColors, colors)
+
+        if self.zbuffer:
+            # 判断Z缓存
+            mask = iz > self.zbuffer.GetPixels(xs, ys)
+            xs, ys, iz, colors = xs[mask], ys[mask], iz[mask], colors[mask]
+            self.zbuffer.SetPixels(xs, ys, iz)
+            self.__UpdateHierarchicalZ(bounds)
+        self.buffer.SetPixels(xs, ys, colors)
+
+    def __DrawBottomFlatTriangle(self, v1, v2, v3, material, gradients):
+        """画平底三角形
+        假定平底的两个顶点为v2和v3，上顶点为v1，两条边都从v1开始
+        """
+        # 确保左边的底顶点在前
+        left, right = (v3, v2) if v3[0] < v2[0] else (v2, v3)
+        dy = right[1] - v1[1]
+        stepLeft = [(b - a) / dy for a, b in zip(v1, left)]
+        stepRight = [(b - a) / dy for a, b in zip(v1, right)]
+        self.__DrawClipTriangle(v1[1], v3[1], v1, v1, stepLeft, stepRight, material, gradients)
+
+    def __DrawTopFlatTriangle(self, v1, v2, v3, material, gradients):
         """画平顶三角形
-        假定平顶的两个顶点为p1和p2，下顶点为p3
+        假定平顶的两个顶点为v1和v2，下顶点为v3，两条边分别从左右两个平顶顶点开始
+        """
+        left, right = (v2, v1) if v2[0] < v1[0] else (v1, v2)
+        dy = v3[1] - left[1]
+        stepLeft = [(b - a) / dy for a, b in zip(left, v3)]
+        stepRight = [(b - a) / dy for a, b in zip(right, v3)]
+        self.__DrawClipTriangle(v1[1], v3[1], left, right, stepLeft, stepRight, material, gradients)
+
+    def __DrawClipTriangle(self, yTop, yBottom, left, right, stepLeft, stepRight, material=None, gradients=None):
+        """画[yTop, yBottom)之间的扫描线，left、right为两条边在yTop处的顶点属性，stepLeft、stepRight为y每增加1的增量
+        alpha不沿边插值，每条边取起点的值
         """
-
-        def __Init(_p1, _p2, _p3):
-            # 确保p1在左，p2在右
-            if _p2.x < _p1.x:
-                _p1, _p2 = _p2, _p1
-
-            dy = _p3.y - _p1.y
-            dxLeft = (_p3.x - _p1.x) / dy
-            dxRight = (_p3.x - _p2.x) / dy
-
-            iz1, iz2, iz3 = 1 / _p1.z, 1 / _p2.z, 1 / _p3.z
-            dizLeft = (iz3 - iz1) / dy
-            dizRight = (iz3 - iz2) / dy
-            dcLeft = (_p3.color - _p1.color) / dy
-            dcRight = (_p3.color - _p2.color) / dy
-            xs, xe = _p1.x, _p2.x
-            izs, ize = iz1, iz2
-            cs, ce = _p1.color, _p2.color
-            log.logger.debug('top flat: {}\n{}\n{}\n'.format(p1, p2, p3))
-            if isinstance(_p1, UVPoint):
-                iu1, iv1 = _p1.u / _p1.z, _p1.v / _p1.z
-                iu2, iv2 = _p2.u / _p2.z, _p2.v / _p2.z
-                iu3, iv3 = _p3.u / _p3.z, _p3.v / _p3.z
-                ts, te = [iu1, iv1], [iu2, iv2]
-                dtLeft = ((iu3 - iu1) / dy, (iv3 - iv1) / dy)
-                dtRight = ((iu3 - iu2) / dy, (iv3 - iv2) / dy)
-                return (xs, xe, dxLeft, dxRight), (cs, ce, dcLeft, dcRight), (izs, ize, dizLeft, dizRight), (ts, te, dtLeft, dtRight)
-            else:
-                return (xs, xe, dxLeft, dxRight), (cs, ce, dcLeft, dcRight), (izs, ize, dizLeft, dizRight), None
-
-        self.__DrawClipTriangle(p1, p2, p3, __Init)
-
-    def __DrawClipTriangle(self, p1, p2, p3, initFunc):
-        x1, y1, iz1, c1 = p1.x, p1.y, 1 / p1.z, p1.color
-        x2, y2, iz2, c2 = p2.x, p2.y, 1 / p2.z, p2.color
-        x3, y3, iz3, c3 = p3.x, p3.y, 1 / p3.z, p3.color
-        posInfo, colorInfo, zInfo, textureInfo = initFunc(p1, p2, p3)
-        xs, xe, dxLeft, dxRight = posInfo
-        izs, ize, dizLeft, dizRight = zInfo
-        cs, ce, dcLeft, dcRight = colorInfo
-        if textureInfo:
-            ts, te, dtLeft, dtRight = textureInfo
-        minClipX = self.clipRegion[0].x
         minClipY = self.clipRegion[0].y
-        maxClipX = self.clipRegion[1].x
         maxClipY = self.clipRegion[1].y
 
-        # 裁剪Y轴上顶点
-        if y1 < minClipY:
-            xs = xs + dxLeft * (minClipY - y1)
-            xe = xe + dxRight * (minClipY - y1)
-            izs = izs + dizLeft * (minClipY - y1)
-            ize = ize + dizRight * (minClipY - y1)
-            cs = Color.Lerp(c1, c2, minClipY / (y3 - y1))
-            ce = Color.Lerp(c1, c3, minClipY / (y3 - y1))
-            y1 = minClipY
-            iy1 = int(y1)
-        else:
-            iy1 = math.ceil(y1)
-            xs = xs + dxLeft * (iy1 - y1)
-            xe = xe + dxRight * (iy1 - y1)
-            izs = izs + dizLeft * (iy1 - y1)
-            ize = ize + dizRight * (iy1 - y1)
-
-        # 裁剪Y轴下顶点
-        if y3 > maxClipY:
-            y3 = maxClipY
-            c3 = Color.Lerp(c1, c3, maxClipY / (y3 - y1))
-            iy3 = int(y3) - 1
-        else:
-            iy3 = math.ceil(y3) - 1
-
-        # X点都在裁剪范围内
-        if minClipX <= x1 <= maxClipX and minClipX <= x2 <= maxClipX and minClipX <= x3 <= maxClipX:
-            for loopY in range(iy1, iy3 + 1):
-                if textureInfo:
-                    self.__DrawTexturedHorizontalLine(round(xs), round(xe), izs, ize, loopY, cs, ce, ts, te, p1.material)
-                    xs += dxLeft
-                    xe += dxRight
-                    cs += dcLeft
-                    ce += dcRight
-                    izs += dizLeft
-                    ize += dizRight
-                    ts[0] += dtLeft[0]
-                    ts[1] += dtLeft[1]
-                    te[0] += dtRight[0]
-                    te[1] += dtRight[1]
-                else:
-                    self.__DrawHorizontalLine(round(xs), round(xe), izs, ize, loopY, cs, ce)
-                    xs += dxLeft
-                    xe += dxRight
-                    izs += dizLeft
-                    ize += dizRight
-                    cs += dcLeft
-                    ce += dcRight
+        # 裁剪Y轴上下顶点（同时限制在缓存范围内），再把两条边的起始值步进到第一条扫描线上
+        # X轴的裁剪在画扫描线时处理
+        iy1 = max(math.ceil(yTop), math.ceil(minClipY), 0)
+        iy3 = min(math.ceil(yBottom), math.ceil(maxClipY), self.buffer.height) - 1
+        if iy1 > iy3:
+            return
+        # 去掉y之后两条边的属性为[x, 1/z, r, g, b, a(, u/z, v/z)]
+        edges = np.delete(np.array((left, right), dtype=np.float64), 1, axis=1)
+        steps = np.delete(np.array((stepLeft, stepRight), dtype=np.float64), 1, axis=1)
+        steps[:, 5] = 0
+        edges += steps * (iy1 - yTop)
+        if self.interpolationMode == EInterpolationMode.FixedPoint and not material:
+            self.__DrawFixedPointRows(iy1, iy3, edges, steps)
+            return
 
-        else:
-            # TODO 这里没有对裁剪情况做纹理映射
-            # 裁剪X轴会稍微慢一些
-            for loopY in range(iy1, iy3 + 1):
-                left = xs
-                right = xe
-                leftZ = izs
-                rightZ = ize
-                leftC = cs
-                rightC = ce
-                xs += dxLeft
-                xe += dxRight
-                izs += dizLeft
-                ize += dizRight
-                cs += dcLeft
-                ce += dcRight
-                if left < minClipX:
-                    left = minClipX
-                    leftZ = izs + (ize - izs) * minClipX / (xe - xs)
-                    leftC = Color.Lerp(cs, ce, minClipX / (xe - xs))
-                    if right < minClipX:
-                        continue
-                if right > maxClipX:
-                    right = maxClipX
-                    rightZ = izs + (ize - izs) * maxClipX / (xe - xs)
-                    rightC = Color.Lerp(cs, ce, maxClipX / (xe - xs))
-                    if left > maxClipX:
-                        continue
-                self.__DrawHorizontalLine(round(left), round(right), leftZ, rightZ, loopY, leftC, rightC)
+        # 逐行累加增量得到每条扫描线两端的属性（cumsum按顺序累加，与逐行相加的结果相同）
+        rows = np.empty((iy3 - iy1 + 1, 2, edges.shape[1]), dtype=np.float64)
+        rows[0] = edges
+        rows[1:] = steps
+        rows = np.cumsum(rows, axis=0).tolist()
+        for loopY, (l, r) in enumerate(rows, iy1):
+            if material:
+                self.__DrawTexturedHorizontalLine(round(l[0]), round(r[0]), l[1], r[1], loopY, l[2:6], r[2:6],
+                                                  l[6:8], r[6:8], material, gradients)
+            else:
+                self.__DrawHorizontalLine(round(l[0]), round(r[0]), l[1], r[1], loopY, l[2:6], r[2:6])
+
+    def __DrawFixedPointRows(self, iy1, iy3, edges, steps):
+        """用定点整数插值一次性画出扫描线iy1到iy3（edges为两条边步进到第iy1条扫描线的属性，steps为每行的增量，
+        iy1和iy3已经裁剪到裁剪区域和缓存范围内）
+        每条扫描线两端的x、颜色和1/z由起始值加上未取整的增量乘以行号得到后再转成定点整数（取整误差不随行数累积），
+        扫描线内再按整数步长插值，所有扫描线的像素一起做Z缓存测试，颜色打包成32位RGBA后一次写入
+        """
+        colorOne = 1 << self.ColorFractionBits
+        depthOne = 1 << self.DepthFractionBits
+
+        # 每条扫描线两端的属性[x, 1/z, r, g, b]，颜色和1/z转成定点整数
+        rows = np.arange(iy3 - iy1 + 1, dtype=np.int64)
+        left, right = edges[:, None, :5] + steps[:, None, :5] * rows[:, None]
+        x1 = np.rint(left[:, 0]).astype(np.int64)
+        x2 = np.rint(right[:, 0]).astype(np.int64)
+        iz1 = np.rint(left[:, 1] * depthOne).astype(np.int64)
+        iz2 = np.rint(right[:, 1] * depthOne).astype(np.int64)
+        c1 = np.rint(left[:, 2:5] * colorOne).astype(np.int64)
+        c2 = np.rint(right[:, 2:5] * colorOne).astype(np.int64)
+        # 与__DrawHorizontalLine一样保证x1在左边
+        swap = x1 > x2
+        x1, x2 = np.where(swap, x2, x1), np.where(swap, x1, x2)
+        c1, c2 = np.where(swap[:, None], c2, c1), np.where(swap[:, None], c1, c2)
+        iz1, iz2 = np.where(swap, iz2, iz1), np.where(swap, iz1, iz2)
+
+        # 扫描线内每个像素的整数步长，再裁剪到裁剪区域和缓存范围内
+        width = np.maximum(x2 - x1, 1)
+        dc = (c2 - c1) // width[:, None]
+        diz = (iz2 - iz1) // width
+        start = np.maximum(x1, max(0, math.ceil(self.clipRegion[0].x)))
+        end = np.minimum(x2, min(self.buffer.width, math.ceil(self.clipRegion[1].x)))
+        counts = np.maximum(end - start, 0)
+        total = int(counts.sum())
+        if total == 0:
+            return
+
+        # 展开所有扫描线上的像素
+        row = np.repeat(rows, counts)
+        xsPixel = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts) + start[row]
+        ysPixel = row + iy1
+        steps = xsPixel - x1[row]
+        iz = (iz1[row] + steps * diz[row]) / depthOne
+        colors = (c1[row] + steps[:, None] * dc[row] + (colorOne >> 1)) >> self.ColorFractionBits
+
+        if self.zbuffer:
+            # 判断Z缓存
+            mask = iz > self.zbuffer.GetPixels(xsPixel, ysPixel)
+            xsPixel, ysPixel, iz, colors = xsPixel[mask], ysPixel[mask], iz[mask], colors[mask]
+            self.zbuffer.SetPixels(xsPixel, ysPixel, iz)
+
+        # 打包成32位RGBA（alpha与浮点插值一致，取起点颜色的值）
+        colors = np.clip(colors, 0, 255).astype(np.uint32)
+        alpha = np.uint32(min(max(round(edges[0, 5]), 0), 255))
+        packed = colors[:, 0] | (colors[:, 1] << 8) | (colors[:, 2] << 16) | (alpha << 24)
+        self.buffer.SetPackedPixels(xsPixel, ysPixel, packed)
+
+    def __ClipSpan(self, x1, x2, y):
+        """将扫描线[x1, x2)裁剪到裁剪区域和缓存范围内，返回裁剪后的区间，完全被裁掉时返回None"""
+        if not (max(0, math.ceil(self.clipRegion[0].y)) <= y < min(self.buffer.height, math.ceil(self.clipRegion[1].y))):
+            return None
+        start = max(x1, 0, math.ceil(self.clipRegion[0].x))
+        end = min(x2, self.buffer.width, math.ceil(self.clipRegion[1].x))
+        if start >= end:
+            return None
+        return start, end
 
     def __DrawHorizontalLine(self, x1, x2, iz1, iz2, y, c1, c2):
-        """画水平扫描线（颜色不同则对颜色插值）"""
+        """画水平扫描线（颜色不同则对颜色插值），c1、c2为[r, g, b, a]
+        整条扫描线的1/z和颜色一次性用数组插值，Z缓存测试以掩码的形式完成，最后一次写入所有通过测试的像素
+        """
         if x1 > x2:
             x1, x2 = x2, x1
             c1, c2 = c2, c1
@@ -287,23 +617,34 @@ class Rasterizer(object):
         elif x1 == x2:
             return
 
-        diz = (iz2 - iz1) / (x2 - x1)
-        iz = iz1
-        sameColor = c1 == c2
-        if sameColor:
-            for x in range(x1, x2):
-                self.__SetBufferPixel(x, y, iz, c1)
-                iz += diz
+        span = self.__ClipSpan(x1, x2, y)
+        if not span:
+            return
+        start, end = span
+
+        # 扫描线上每个像素相对于x1的步数
+        steps = np.arange(start - x1, end - x1, dtype=np.float64)
+        iz = iz1 + steps * ((iz2 - iz1) / (x2 - x1))
+        if c1 == c2:
+            colors = np.array(c1, dtype=np.float64)
         else:
-            dc = (c2 - c1) / (x2 - x1)
-            color = c1
-            for x in range(x1, x2):
-                self.__SetBufferPixel(x, y, iz, color)
-                iz += diz
-                color += dc
-
-    def __DrawTexturedHorizontalLine(self, x1, x2, iz1, iz2, y, c1, c2, uv1, uv2, material):
-        """画带纹理的水平扫描线（颜色不同则对颜色插值）"""
+            # alpha取起点颜色的值
+            colors = np.empty((end - start, 4), dtype=np.float64)
+            for k in range(3):
+                colors[:, k] = c1[k] + steps * ((c2[k] - c1[k]) / (x2 - x1))
+            colors[:, 3] = c1[3]
+
+        mask = None
+        if self.zbuffer:
+            # 判断Z缓存
+            mask = iz > self.zbuffer.GetSpan(y, start, end)
+            self.zbuffer.SetSpan(y, start, end, iz, mask)
+        self.buffer.SetSpan(y, start, end, colors, mask)
+
+    def __DrawTexturedHorizontalLine(self, x1, x2, iz1, iz2, y, c1, c2, uv1, uv2, material, gradients):
+        """画带纹理的水平扫描线（颜色不同则对颜色插值）
+        与__DrawHorizontalLine一样整条扫描线一次性插值，纹理用整条扫描线的uv一次性采样
+        """
         if x1 > x2:
             x1, x2 = x2, x1
             c1, c2 = c2, c1
@@ -312,75 +653,89 @@ class Rasterizer(object):
         elif x1 == x2:
             return
 
-        dc = (c2 - c1) / (x2 - x1)
-        diz = (iz2 - iz1) / (x2 - x1)
-        iz = iz1
-        diu = (uv2[0] - uv1[0]) / (x2 - x1)
-        div = (uv2[1] - uv1[1]) / (x2 - x1)
-        iu, iv = uv1
-        baseColor = c1
-        for x in range(x1, x2):
-            # 获取纹理颜色
-            # 除以z对uv做透视矫正，否则渲染的纹理会变形
-            u, v = iu / iz, iv / iz
-            textureColor = self.__GetTexturePixelColor(u, v, material)
-            # 用光照颜色去调制纹理颜色
-            finalColor = Color()
-            Color.Multiply(finalColor, textureColor, baseColor)
-            self.__SetBufferPixel(x, y, iz, finalColor)
-
-            baseColor += dc
-            iz += diz
-            iu += diu
-            iv += div
-
-    def __SetBufferPixel(self, x, y, z, c):
+        span = self.__ClipSpan(x1, x2, y)
+        if not span:
+            return
+        start, end = span
+
+        # 从裁剪后的起点开始插值
+        steps = np.arange(start - x1, end - x1, dtype=np.float64)
+        iz = iz1 + steps * ((iz2 - iz1) / (x2 - x1))
+        iu = uv1[0] + steps * ((uv2[0] - uv1[0]) / (x2 - x1))
+        iv = uv1[1] + steps * ((uv2[1] - uv1[1]) / (x2 - x1))
+        baseColors = np.empty((end - start, 3), dtype=np.float64)
+        for k in range(3):
+            baseColors[:, k] = c1[k] + steps * ((c2[k] - c1[k]) / (x2 - x1))
+
+        segmentLength = None
+        if self.textureMappingMode == ETextureMappingMode.SubdividedAffine:
+            segmentLength = self.AffineSpanLength
+        textureColors = self.__SampleTexture(material, iz, iu, iv, *gradients, segmentLength=segmentLength)
+        colors = self.__ModulateTextureColors(textureColors, baseColors)
+
+        mask = None
         if self.zbuffer:
             # 判断Z缓存
-            if z > self.zbuffer.Get((x, y)):
-                self.buffer.Set((x, y), c)
-                self.zbuffer.Set((x, y), z)
-        else:
-            self.buffer.Set((x, y), c)
-
-    def __GetTexturePixelColor(self, u, v, material):
-        # while u < 0:
-        #     u += 1
-        # while u > 1:
-        #     u -= 1
-        # while v < 0:
-        #     v += 1
-        # while v > 1:
-        #     v -= 1
-        # print('u: {}, v: {}'.format(u, v))
-
-        # 点采样
-        if material.textureFilterMode == ETextureFilterMode.Point:
-            uPixelInt = min(round(material.textureSize[0] * u), material.textureSize[0] - 1)
-            vPixelInt = min(round(material.textureSize[1] * v), material.textureSize[1] - 1)
-            temp = material.texture[uPixelInt, vPixelInt]
-            textureColor = Color(temp[0], temp[1], temp[2])
-        # 双线性插值
-        elif material.textureFilterMode == ETextureFilterMode.Bilinear:
-            uPixel = min(material.textureSize[0] * u, material.textureSize[0] - 1)
-            vPixel = min(material.textureSize[1] * v, material.textureSize[1] - 1)
-            uPixelInt = math.floor(uPixel)
-            uError = uPixel - uPixelInt
-            vPixelInt = math.floor(vPixel)
-            vError = vPixel - vPixelInt
-            if uPixelInt > 0 and vPixelInt > 0:
-                c00 = material.texture[uPixelInt - 1, vPixelInt - 1]
-                c01 = material.texture[uPixelInt, vPixelInt - 1]
-                c10 = material.texture[uPixelInt - 1, vPixelInt]
-                c11 = material.texture[uPixelInt, vPixelInt]
-                textureColor = Color(c00[0], c00[1], c00[2]) * (1 - uError) * (1 - vError) + \
-                               Color(c01[0], c01[1], c01[2]) * uError * (1 - vError) + \
-                               Color(c10[0], c10[1], c10[2]) * (1 - uError) * vError + \
-                               Color(c11[0], c11[1], c11[2]) * uError * vError
-            else:
-                temp = material.texture[uPixelInt, vPixelInt]
-                textureColor = Color(temp[0], temp[1], temp[2])
-        return textureColor
+            mask = iz > self.zbuffer.GetSpan(y, start, end)
+            self.zbuffer.SetSpan(y, start, end, iz, mask)
+        self.buffer.SetSpan(y, start, end, colors, mask)
+
+    @staticmethod
+    def __GetTextureGradients(positions, attrs):
+        """计算一批三角形上1/z、u/z、v/z（attrs为N*3*3）对屏幕x和y的偏导数（它们在屏幕空间是线性的），用于选择mipmap级别
+        positions为N*3*2的屏幕坐标，返回两个N*3的数组，退化的三角形偏导数为0
+        """
+        px, py = positions[..., 0], positions[..., 1]
+        dx1, dy1 = (px[:, 1] - px[:, 0])[:, None], (py[:, 1] - py[:, 0])[:, None]
+        dx2, dy2 = (px[:, 2] - px[:, 0])[:, None], (py[:, 2] - py[:, 0])[:, None]
+        area = dx1 * dy2 - dx2 * dy1
+        degenerate = np.abs(area) < 1e-9
+        area[degenerate] = 1
+        da1, da2 = attrs[:, 1] - attrs[:, 0], attrs[:, 2] - attrs[:, 0]
+        gradX = np.where(degenerate, 0, (da1 * dy2 - da2 * dy1) / area)
+        gradY = np.where(degenerate, 0, (da2 * dx1 - da1 * dx2) / area)
+        return gradX, gradY
+
+    @staticmethod
+    def __SampleTexture(material, iz, iu, iv, gradX, gradY, segmentLength=None):
+        """对一组像素采样纹理，iz、iu、iv为像素的1/z、u/z、v/z，gradX、gradY为它们对屏幕x和y的偏导数
+        除以1/z对uv做透视矫正，否则渲染的纹理会变形；mipmap级别由uv对屏幕坐标的偏导数决定
+        segmentLength不为None时像素是一条连续的扫描线，只在每隔segmentLength个像素以及最后一个像素上精确计算uv和mipmap级别，
+        其余像素在相邻两个端点间线性插值
+        """
+        if segmentLength is None or len(iz) <= 2:
+            us, vs, lods = Rasterizer.__GetTextureCoords(material, iz, iu, iv, gradX, gradY)
+            return material.texture.Sample(us, vs, material.textureFilterMode, lods)
+
+        knots = np.arange(0, len(iz) + segmentLength - 1, segmentLength)
+        knots[-1] = len(iz) - 1
+        values = np.stack(Rasterizer.__GetTextureCoords(material, iz[knots], iu[knots], iv[knots], gradX, gradY),
+                          axis=1)
+        slopes = np.diff(values, axis=0) / np.diff(knots)[:, None]
+        indices = np.arange(len(iz))
+        segments = np.minimum(indices // segmentLength, len(knots) - 2)
+        values = values[segments] + slopes[segments] * (indices - knots[segments])[:, None]
+        return material.texture.Sample(values[:, 0], values[:, 1], material.textureFilterMode, values[:, 2])
+
+    @staticmethod
+    def __GetTextureCoords(material, iz, iu, iv, gradX, gradY):
+        """计算透视矫正后的uv和mipmap级别"""
+        us = iu / iz
+        vs = iv / iz
+        # u = (u/z) / (1/z)，所以du = (d(u/z) - u * d(1/z)) / (1/z)
+        dudx = (gradX[1] - us * gradX[0]) / iz
+        dvdx = (gradX[2] - vs * gradX[0]) / iz
+        dudy = (gradY[1] - us * gradY[0]) / iz
+        dvdy = (gradY[2] - vs * gradY[0]) / iz
+        return us, vs, material.texture.GetLod(dudx, dvdx, dudy, dvdy)
+
+    @staticmethod
+    def __ModulateTextureColors(textureColors, baseColors):
+        """用光照颜色去调制纹理颜色（与Color.Multiply一致），返回N*4的颜色"""
+        colors = np.empty((len(textureColors), 4), dtype=np.float64)
+        colors[:, :3] = np.minimum(np.floor_divide(textureColors * baseColors[:, :3], 256), 255)
+        colors[:, 3] = 255
+        return colors
 
     def SetClipRegion(self, p1, p2):
         """设置裁剪区域"""
@@ -391,79 +746,446 @@ class Rasterizer(object):
 
 
 class Buffer(object):
+    """缓存基类，数据存放在连续的numpy数组中，按行优先存储（data[y, x]）"""
+
     DefaultWidth = 800
     DefaultHeight = 800
+    # 每个像素的通道数和数据类型，由子类指定
+    Channels = 1
+    DataType = np.float32
 
-    def __init__(self, width=DefaultWidth, height=DefaultHeight, d=None):
+    def __init__(self, width=DefaultWidth, height=DefaultHeight, d=0):
         self.width = width
         self.height = height
-        self.data = [[d for i in range(self.width)] for j in range(self.height)]
+        shape = (height, width) if self.Channels == 1 else (height, width, self.Channels)
+        self.data = np.empty(shape, dtype=self.DataType)
+        self.Clear(d)
 
     def Get(self, pos):
-        return self.data[pos[0]][pos[1]]
+        return self.data[pos[1], pos[0]]
 
     def IsPositionValid(self, pos):
         return 0 <= pos[0] < self.width and 0 <= pos[1] < self.height
 
     def Set(self, pos, d):
         if self.IsPositionValid(pos):
-            self.data[pos[0]][pos[1]] = d
+            self.data[pos[1], pos[0]] = d
             return True
         return False
 
-    def Clear(self, d=None):
-        for i in range(self.width):
-            for j in range(self.height):
-                self.data[i][j] = d
+    def GetSpan(self, y, x1, x2):
+        """获取第y行[x1, x2)的数据"""
+        return self.data[y, x1:x2]
+
+    def SetSpan(self, y, x1, x2, values, mask=None):
+        """写入第y行[x1, x2)的数据，mask不为None时只写入mask为True的像素"""
+        row = self.data[y, x1:x2]
+        if mask is None:
+            row[...] = values
+        elif np.ndim(values) == 0 or np.shape(values) == row.shape[1:]:
+            row[mask] = values
+        else:
+            row[mask] = values[mask]
+
+    def GetPixels(self, xs, ys):
+        """获取一组像素的数据，xs和ys为等长的坐标数组"""
+        return self.data[ys, xs]
+
+    def SetPixels(self, xs, ys, values):
+        """写入一组像素的数据，xs和ys为等长的坐标数组"""
+        self.data[ys, xs] = values
+
+    def GetRegion(self, x1, y1, x2, y2):
+        """获取像素区域[x1, x2)*[y1, y2)的数据"""
+        return self.data[y1:y2, x1:x2]
+
+    def Clear(self, d=0):
+        self.data[...] = d
 
     def GetData(self):
-        result = []
-        for y in range(self.height):
-            for x in range(self.width):
-                d = self.data[x][y]
-                result.append(d)
-        return result
+        return self.data
+
+    def Assign(self, data):
+        """用同样大小的数组整体覆盖缓存数据"""
+        self.data[...] = data
+
+    @classmethod
+    def Wrap(cls, data):
+        """用已有的数组（例如共享内存中的数组）构造缓存，既不复制也不清空数据"""
+        buffer = cls.__new__(cls)
+        buffer.height, buffer.width = data.shape[:2]
+        buffer.data = data
+        return buffer
 
 
 class RenderBuffer(Buffer):
-    """渲染缓存，存放像素颜色数据"""
+    """渲染缓存，存放像素颜色数据（RGBA，每通道uint8）"""
+
+    Channels = 4
+    DataType = np.uint8
 
     def __init__(self, width=Buffer.DefaultWidth, height=Buffer.DefaultHeight, color=Color()):
         super(RenderBuffer, self).__init__(width, height, color)
-        c = color.tuple
-        self.raw = [c for i in range(self.width) for j in range(self.height)]
+
+    def Get(self, pos):
+        return Color(*self.data[pos[1], pos[0]].tolist())
 
     def Set(self, pos, color):
         # assert isinstance(color, Color), 'The param color is not a instance of Color'
-        if super(RenderBuffer, self).Set(pos, color):
-            self.raw[pos[1] * self.width + pos[0]] = color.tuple
+        return super(RenderBuffer, self).Set(pos, color.tuple)
 
-    def Clear(self, color=Color()):
-        super(RenderBuffer, self).Clear(color)
-        c = color.tuple
-        self.raw = [c for i in range(self.width) for j in range(self.height)]
+    def SetSpan(self, y, x1, x2, colors, mask=None):
+        """写入一段浮点颜色（四舍五入后截断到0-255）"""
+        colors = np.clip(np.rint(colors), 0, 255)
+        super(RenderBuffer, self).SetSpan(y, x1, x2, colors, mask)
 
-    def GetData(self):
-        return self.raw
+    def SetPixels(self, xs, ys, colors):
+        """写入一组像素的浮点颜色（四舍五入后截断到0-255）"""
+        super(RenderBuffer, self).SetPixels(xs, ys, np.clip(np.rint(colors), 0, 255))
+
+    def SetPackedPixels(self, xs, ys, values):
+        """写入一组打包的32位RGBA颜色（r在最低字节）"""
+        self.data.view('<u4')[ys, xs, 0] = values
 
-    # def __str__(self):
-    #     result = []
-    #     for line in self.data:
-    #         for item in line:
-    #             result.append(str(item))
-    #             result.append(' ')
-    #         result.append('\n')
-    #     return ''.join(result)
+    def Clear(self, color=Color()):
+        # 把RGBA打包成一个32位整数，按32位整块填充
+        packed = np.array(color.tuple, dtype=np.uint8).view(np.uint32)[0]
+        self.data.view(np.uint32).fill(packed)
 
 
 class ZBuffer(Buffer):
-    """Z缓存"""
+    """Z缓存，存放每个像素的1/z（float32），值越大越靠近相机
+    清空时不逐像素写入，而是递增当前帧号：每个像素记录最后一次写入时的帧号（epoch），
+    帧号与当前帧号不同的像素视为已清空（值为clearValue），所以清空的开销与像素数量无关
+    """
+
+    EpochType = np.uint32
 
     def __init__(self, width=Buffer.DefaultWidth, height=Buffer.DefaultHeight):
+        self.epoch = np.zeros((height, width), dtype=self.EpochType)
+        self.frame = 0
+        self.clearValue = 0
         super(ZBuffer, self).__init__(width, height, 0)
 
+    def Get(self, pos):
+        x, y = pos
+        return self.data[y, x] if self.epoch[y, x] == self.frame else self.DataType(self.clearValue)
+
+    def Set(self, pos, d):
+        if super(ZBuffer, self).Set(pos, d):
+            self.epoch[pos[1], pos[0]] = self.frame
+            return True
+        return False
+
+    def GetSpan(self, y, x1, x2):
+        return np.where(self.epoch[y, x1:x2] == self.frame, self.data[y, x1:x2], self.DataType(self.clearValue))
+
+    def SetSpan(self, y, x1, x2, values, mask=None):
+        super(ZBuffer, self).SetSpan(y, x1, x2, values, mask)
+        if mask is None:
+            self.epoch[y, x1:x2] = self.frame
+        else:
+            self.epoch[y, x1:x2][mask] = self.frame
+
+    def GetPixels(self, xs, ys):
+        return np.where(self.epoch[ys, xs] == self.frame, self.data[ys, xs], self.DataType(self.clearValue))
+
+    def SetPixels(self, xs, ys, values):
+        super(ZBuffer, self).SetPixels(xs, ys, values)
+        self.epoch[ys, xs] = self.frame
+
+    def GetRegion(self, x1, y1, x2, y2):
+        return np.where(self.epoch[y1:y2, x1:x2] == self.frame, self.data[y1:y2, x1:x2],
+                        self.DataType(self.clearValue))
+
     def Clear(self, d=0):
-        super(ZBuffer, self).Clear(d)
+        self.clearValue = d
+        self.frame += 1
+        # 帧号用完时才真正清空一次
+        if self.frame > np.iinfo(self.EpochType).max:
+            self.data[...] = d
+            self.epoch[...] = 0
+            self.frame = 0
+
+    def GetData(self):
+        """返回清空后的像素已经替换为clearValue的数据（副本）"""
+        return self.GetRegion(0, 0, self.width, self.height)
+
+    def Assign(self, data):
+        super(ZBuffer, self).Assign(data)
+        self.epoch[...] = self.frame
+
+    @classmethod
+    def Wrap(cls, data):
+        buffer = super(ZBuffer, cls).Wrap(data)
+        # 包装的数据全部视为当前帧写入的
+        buffer.epoch = np.zeros(data.shape[:2], dtype=cls.EpochType)
+        buffer.frame = 0
+        buffer.clearValue = 0
+        return buffer
+
+
+class HierarchicalZBuffer(ZBuffer):
+    """分层Z缓存
+    在逐像素的Z缓存之外，按tileSize*tileSize分块记录每块中最远的深度（即最小的1/z）。
+    三角形在某个块内最近的深度也不比该块最远的深度近时，整块像素都不可能通过Z测试，光栅器可以直接丢弃整块或整个三角形。
+    通过Z测试的写入只会让像素变近，所以分块数据没有及时更新时仍然是保守的（只会少丢弃，不会错误丢弃），
+    光栅器在画完每个三角形后调用UpdateTiles更新它覆盖的块
+    """
+
+    TileSize = 8
+
+    def __init__(self, width=Buffer.DefaultWidth, height=Buffer.DefaultHeight, tileSize=TileSize):
+        self.tileSize = tileSize
+        self.tileData = np.zeros((-(-height // tileSize), -(-width // tileSize)), dtype=ZBuffer.DataType)
+        super(HierarchicalZBuffer, self).__init__(width, height)
+
+    def Clear(self, d=0):
+        super(HierarchicalZBuffer, self).Clear(d)
+        self.tileData[...] = d
+
+    @classmethod
+    def Wrap(cls, data, tileSize=TileSize):
+        buffer = super(HierarchicalZBuffer, cls).Wrap(data)
+        buffer.tileSize = tileSize
+        buffer.tileData = np.empty((-(-buffer.height // tileSize), -(-buffer.width // tileSize)), dtype=ZBuffer.DataType)
+        buffer.UpdateTiles(0, 0, buffer.width, buffer.height)
+        return buffer
+
+    def GetTileData(self):
+        """获取每块最远的深度（按块的行列存储）"""
+        return self.tileData
+
+    def IsOccluded(self, x1, y1, x2, y2, nearestInvZ):
+        """像素区域[x1, x2)*[y1, y2)内的所有块最远的深度都不比nearestInvZ远时返回True"""
+        size = self.tileSize
+        tiles = self.tileData[y1 // size:(y2 - 1) // size + 1, x1 // size:(x2 - 1) // size + 1]
+        return bool((nearestInvZ <= tiles).all())
+
+    def UpdateTiles(self, x1, y1, x2, y2):
+        """重新计算像素区域[x1, x2)*[y1, y2)所覆盖的块的最远深度"""
+        if x1 >= x2 or y1 >= y2:
+            return
+        size = self.tileSize
+        tx1, ty1 = x1 // size, y1 // size
+        tx2, ty2 = (x2 - 1) // size + 1, (y2 - 1) // size + 1
+        region = self.GetRegion(tx1 * size, ty1 * size, tx2 * size, ty2 * size)
+        # 缓存边缘不完整的块用无穷远补齐
+        padY = (ty2 - ty1) * size - region.shape[0]
+        padX = (tx2 - tx1) * size - region.shape[1]
+        if padY or padX:
+            region = np.pad(region, ((0, padY), (0, padX)), constant_values=np.inf)
+        self.tileData[ty1:ty2, tx1:tx2] = region.reshape(ty2 - ty1, size, tx2 - tx1, size).min(axis=(1, 3))
+
+
+class ParallelRasterizer(object):
+    """多进程分块并行光栅器
+    把屏幕划分成TileSize*TileSize的块，按包围盒把三角形分到各个块中，再把块分配给进程池中的进程。
+    每个进程把裁剪区域设为自己的块，用与rasterizer相同的设置光栅化块内的三角形，直接写入共享内存中的颜色缓存和Z缓存。
+    各块互不重叠，块内的三角形保持提交顺序，所以结果与单进程绘制相同。
+    纹理的mipmap链在第一次使用时复制到共享内存中，之后每次只把纹理所在的共享内存名和滤波方式发给子进程
+    """
+
+    TileSize = 128
+
+    def __init__(self, rasterizer, numProcesses=None):
+        self.rasterizer = rasterizer
+        self.numProcesses = numProcesses or os.cpu_count() or 1
+        self.pool = None
+        self.colorMemory = None
+        self.depthMemory = None
+        # 已经复制到共享内存中的纹理：id(纹理) -> (纹理, 共享内存, 每一级mipmap的形状和数据类型)
+        self.textureMemory = {}
+
+    def DrawTriangles(self, positions, invZ, colors, uvs=None, materialIds=None, materials=None):
+        """参数与Rasterizer.DrawTriangles相同"""
+        positions = np.asarray(positions, dtype=np.float64)
+        if len(positions) == 0:
+            return
+        buffer = self.rasterizer.buffer
+        zbuffer = self.rasterizer.zbuffer
+        tiles = self.__BinTriangles(positions)
+        if not tiles:
+            return
+
+        # 按三角形数量从多到少，把块分给当前负担最轻的进程
+        tiles.sort(key=lambda tile: len(tile[1]), reverse=True)
+        numTasks = min(self.numProcesses, len(tiles))
+        taskTiles = [[] for i in range(numTasks)]
+        taskLoads = [0] * numTasks
+        for tile in tiles:
+            task = taskLoads.index(min(taskLoads))
+            taskTiles[task].append(tile)
+            taskLoads[task] += len(tile[1])
+
+        # 把当前的缓存内容复制到共享内存中，由各进程直接写入
+        self.__PrepareSharedMemory(buffer, zbuffer)
+        colorData = np.ndarray(buffer.data.shape, dtype=buffer.data.dtype, buffer=self.colorMemory.buf)
+        colorData[...] = buffer.data
+        depthData = None
+        if zbuffer:
+            depthData = np.ndarray(zbuffer.data.shape, dtype=zbuffer.data.dtype, buffer=self.depthMemory.buf)
+            depthData[...] = zbuffer.GetData()
+
+        triangles = (positions, np.asarray(invZ, dtype=np.float64), np.asarray(colors, dtype=np.float64),
+                     None if uvs is None else np.asarray(uvs, dtype=np.float64),
+                     None if materialIds is None else np.asarray(materialIds),
+                     None if materials is None else self.__ShareTextures(materials))
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.numProcesses)
+            # 确保退出时释放进程池和共享内存（Close时取消注册，不会让光栅器一直存活到退出）
+            atexit.register(self.Close)
+        futures = [self.pool.submit(DrawTilesProcess, self.colorMemory.name, buffer.data.shape,
+                                    self.depthMemory.name if zbuffer else None,
+                                    zbuffer.tileSize if isinstance(zbuffer, HierarchicalZBuffer) else None,
+                                    self.rasterizer.rasterizeMode, self.rasterizer.textureMappingMode,
+                                    self.rasterizer.interpolationMode, task, triangles)
+                   for task in taskTiles]
+        for future in futures:
+            future.result()
+
+        buffer.Assign(colorData)
+        if zbuffer:
+            zbuffer.Assign(depthData)
+            if isinstance(zbuffer, HierarchicalZBuffer):
+                zbuffer.UpdateTiles(0, 0, zbuffer.width, zbuffer.height)
+        del colorData, depthData
+
+    def Close(self):
+        """关闭进程池并释放共享内存"""
+        atexit.unregister(self.Close)
+        if self.pool:
+            self.pool.shutdown()
+            self.pool = None
+        textureMemory = [memory for texture, memory, levelFormats in self.textureMemory.values()]
+        for memory in [self.colorMemory, self.depthMemory] + textureMemory:
+            if memory:
+                memory.close()
+                memory.unlink()
+        self.colorMemory = self.depthMemory = None
+        self.textureMemory.clear()
+
+    def __ShareTextures(self, materials):
+        """把材质的纹理复制到共享内存中（每个纹理只复制一次），返回发给子进程的材质描述：
+        (纹理的共享内存名, 每一级mipmap的形状和数据类型, 滤波方式)，没有纹理的材质为None
+        """
+        descriptions = []
+        for material in materials:
+            texture = material.texture
+            if texture is None:
+                descriptions.append(None)
+                continue
+            entry = self.textureMemory.get(id(texture))
+            if entry is None:
+                memory = shared_memory.SharedMemory(create=True, size=sum(level.nbytes for level in texture.levels))
+                offset = 0
+                for level in texture.levels:
+                    np.ndarray(level.shape, dtype=level.dtype, buffer=memory.buf, offset=offset)[...] = level
+                    offset += level.nbytes
+                # 保存纹理的引用，保证id不会被其他纹理重用
+                entry = self.textureMemory[id(texture)] = (texture, memory,
+                                                           [(level.shape, level.dtype.str) for level in texture.levels])
+            descriptions.append((entry[1].name, entry[2], material.textureFilterMode))
+        return descriptions
+
+    def __BinTriangles(self, positions):
+        """按包围盒把三角形分到与裁剪区域相交的块中，返回[(块的像素区域, 三角形下标数组)]"""
+        clipRegion = self.rasterizer.clipRegion
+        buffer = self.rasterizer.buffer
+        clipX1 = max(0, math.ceil(clipRegion[0].x))
+        clipY1 = max(0, math.ceil(clipRegion[0].y))
+        clipX2 = min(buffer.width, math.ceil(clipRegion[1].x))
+        clipY2 = min(buffer.height, math.ceil(clipRegion[1].y))
+        if clipX1 >= clipX2 or clipY1 >= clipY2:
+            return []
+
+        # 包围盒向外扩一个像素后按块取整（多分一些三角形没有关系，块内会按裁剪区域精确绘制）
+        size = self.TileSize
+        xs, ys = positions[..., 0], positions[..., 1]
+        tx1 = np.floor((xs.min(axis=1) - 1) / size)
+        ty1 = np.floor((ys.min(axis=1) - 1) / size)
+        tx2 = np.floor((xs.max(axis=1) + 1) / size)
+        ty2 = np.floor((ys.max(axis=1) + 1) / size)
+
+        tiles = []
+        for ty in range(clipY1 // size, (clipY2 - 1) // size + 1):
+            for tx in range(clipX1 // size, (clipX2 - 1) // size + 1):
+                indices = np.flatnonzero((tx1 <= tx) & (tx <= tx2) & (ty1 <= ty) & (ty <= ty2))
+                if len(indices) == 0:
+                    continue
+                rect = (max(tx * size, clipX1), max(ty * size, clipY1),
+                        min((tx + 1) * size, clipX2), min((ty + 1) * size, clipY2))
+                tiles.append((rect, indices))
+        return tiles
+
+    def __PrepareSharedMemory(self, buffer, zbuffer):
+        """按缓存大小分配（或重用）共享内存"""
+        if self.colorMemory and self.colorMemory.size < buffer.data.nbytes:
+            self.Close()
+        if zbuffer and self.depthMemory and self.depthMemory.size < zbuffer.data.nbytes:
+            self.Close()
+        if not self.colorMemory:
+            self.colorMemory = shared_memory.SharedMemory(create=True, size=buffer.data.nbytes)
+        if zbuffer and not self.depthMemory:
+            self.depthMemory = shared_memory.SharedMemory(create=True, size=zbuffer.data.nbytes)
+
+
+# 子进程中已经打开的共享内存纹理：共享内存名 -> (共享内存, 纹理)，在子进程的整个生命周期内重用
+_sharedTextures = {}
+
+
+def _GetSharedTexture(name, levelFormats):
+    """在子进程中打开（或重用）共享内存中的纹理"""
+    if name not in _sharedTextures:
+        memory = shared_memory.SharedMemory(name=name)
+        levels, offset = [], 0
+        for shape, dtype in levelFormats:
+            level = np.ndarray(shape, dtype=np.dtype(dtype), buffer=memory.buf, offset=offset)
+            levels.append(level)
+            offset += level.nbytes
+        _sharedTextures[name] = (memory, Texture.Wrap(levels))
+    return _sharedTextures[name][1]
+
+
+def DrawTilesProcess(colorMemoryName, shape, depthMemoryName, hierarchicalTileSize, rasterizeMode, textureMappingMode,
+                     interpolationMode, tiles, triangles):
+    """ParallelRasterizer在子进程中执行的任务：把每个块内的三角形画到共享内存中的缓存上
+    hierarchicalTileSize不为None时Z缓存为分层Z缓存，块的大小与主进程相同
+    """
+    positions, invZ, colors, uvs, materialIds, descriptions = triangles
+    materials = None
+    if descriptions is not None:
+        materials = []
+        for description in descriptions:
+            material = Material()
+            if description:
+                name, levelFormats, material.textureFilterMode = description
+                material.texture = _GetSharedTexture(name, levelFormats)
+            materials.append(material)
+    colorMemory = shared_memory.SharedMemory(name=colorMemoryName)
+    depthMemory = shared_memory.SharedMemory(name=depthMemoryName) if depthMemoryName else None
+    buffer = RenderBuffer.Wrap(np.ndarray(shape, dtype=RenderBuffer.DataType, buffer=colorMemory.buf))
+    zbuffer = None
+    if depthMemory:
+        depthData = np.ndarray(shape[:2], dtype=ZBuffer.DataType, buffer=depthMemory.buf)
+        if hierarchicalTileSize:
+            zbuffer = HierarchicalZBuffer.Wrap(depthData, hierarchicalTileSize)
+        else:
+            zbuffer = ZBuffer.Wrap(depthData)
+        del depthData
+
+    rasterizer = Rasterizer(buffer, zbuffer, rasterizeMode, textureMappingMode, interpolationMode)
+    for (x1, y1, x2, y2), indices in tiles:
+        rasterizer.SetClipRegion(Point(x1, y1), Point(x2, y2))
+        rasterizer.DrawTriangles(positions[indices], invZ[indices], colors[indices],
+                                 None if uvs is None else uvs[indices],
+                                 None if materialIds is None else materialIds[indices], materials)
+
+    # 释放对共享内存的引用后才能关闭
+    del rasterizer, buffer, zbuffer
+    colorMemory.close()
+    if depthMemory:
+        depthMemory.close()
 
 
 class RenderInterface(object):
@@ -476,13 +1198,8 @@ class ImageRenderer(RenderInterface):
         self.filename = filename
 
     def Render(self, buffer):
-        image = Image.new('RGBA', (buffer.width, buffer.height))
-        pixels = image.load()
-        image.putdata(buffer.raw)
-        # for i in range(image.size[0]):
-        #     for j in range(image.size[1]):
-        #         pixels[i, j] = buffer.data[i][j].tuple
-
+        # 直接引用缓存的数组内存构造图像，不再逐像素复制
+        image = Image.frombuffer('RGBA', (buffer.width, buffer.height), buffer.GetData(), 'raw', 'RGBA', 0, 1)
         image.save(self.filename)
 
 
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+import collections
+import numpy as np
+import utils.log as log
+from graphics.object import EGameObjectState
+
+
+class Scene(object):
+    """场景：用包围盒层次结构（BVH）组织物体，按视锥体一次剔除整棵子树
+    物体可以是GameObject或GameObjectInstance，包围球为(worldPos, maxRadius)。
+    树按物体包围球球心的最长轴中位数自顶向下划分，每个节点覆盖order中连续的一段物体，
+    因此节点的包围盒可以按层用reduceat一次性重新计算（refit）。
+    物体移动后调用Update重新计算包围盒（树的结构不变）；增删物体后在下一次剔除时重建整棵树
+    """
+
+    # 叶子节点最多包含的物体数
+    LeafSize = 4
+
+    def __init__(self):
+        self.objects = []
+        self.__indexDict = {}
+        self.__needRebuild = True
+        # 每个物体的包围球（按objects的顺序）
+        self.__centers = np.zeros((0, 3), dtype=np.float64)
+        self.__radii = np.zeros(0, dtype=np.float64)
+        # 叶子顺序下的物体下标，以及每个节点覆盖的order区间[start, end)、子节点（叶子为-1）和包围盒
+        self.__order = np.zeros(0, dtype=np.int64)
+        self.__nodeStart = self.__nodeEnd = self.__nodeLeft = self.__nodeRight = np.zeros(0, dtype=np.int64)
+        self.__nodeMin = self.__nodeMax = np.zeros((0, 3), dtype=np.float64)
+        # 每一层的节点
+        self.__levels = []
+
+    def Add(self, obj):
+        if id(obj) in self.__indexDict:
+            return
+        self.__indexDict[id(obj)] = len(self.objects)
+        self.objects.append(obj)
+        self.__needRebuild = True
+
+    def Remove(self, obj):
+        index = self.__indexDict.pop(id(obj), None)
+        if index is None:
+            return
+        del self.objects[index]
+        self.__indexDict = {id(o): i for i, o in enumerate(self.objects)}
+        self.__needRebuild = True
+
+    def Update(self, movedObjects=None):
+        """物体移动（或缩放）后重新计算包围球和所有节点的包围盒，movedObjects为None时更新所有物体"""
+        if self.__needRebuild:
+            return
+        if movedObjects is None:
+            self.__UpdateSpheres(range(len(self.objects)))
+        else:
+            self.__UpdateSpheres([self.__indexDict[id(obj)] for obj in movedObjects])
+        self.__Refit()
+
+    def Rebuild(self):
+        """重新构建整棵树（物体移动很多以后包围盒重叠变大，重建可以恢复剔除效率）"""
+        n = len(self.objects)
+        self.__centers = np.zeros((n, 3), dtype=np.float64)
+        self.__radii = np.zeros(n, dtype=np.float64)
+        self.__UpdateSpheres(range(n))
+
+        self.__order = np.arange(n, dtype=np.int64)
+        nodes = []
+        levels = collections.defaultdict(list)
+        if n > 0:
+            self.__BuildNode(0, n, 0, nodes, levels)
+        nodes = np.array(nodes, dtype=np.int64).reshape(-1, 4)
+        self.__nodeStart, self.__nodeEnd = nodes[:, 0], nodes[:, 1]
+        self.__nodeLeft, self.__nodeRight = nodes[:, 2], nodes[:, 3]
+        self.__levels = [np.array(levels[depth], dtype=np.int64) for depth in range(len(levels))]
+        self.__nodeMin = np.zeros((len(nodes), 3), dtype=np.float64)
+        self.__nodeMax = np.zeros((len(nodes), 3), dtype=np.float64)
+        self.__Refit()
+        self.__needRebuild = False
+        log.logger.debug('Rebuild scene BVH: {} objects, {} nodes, depth {}'.format(n, len(nodes), len(levels)))
+
+    def Cull(self, camera):
+        """用相机的视锥体剔除物体，返回包围球与视锥体相交的物体（按加入场景的顺序）
+        从根节点开始逐层处理：节点的包围盒完全在某个平面外则整棵子树丢弃，完全在所有平面内则整棵子树接受，
+        只有跨越平面的叶子节点才逐个测试物体的包围球。同一层的节点一次性用数组测试
+        """
+        if self.__needRebuild:
+            self.Rebuild()
+        if not self.objects:
+            return []
+        planes = camera.GetFrustumPlanes()
+        normals, offsets = planes[:, :3], planes[:, 3]
+        absNormals = np.abs(normals)
+
+        accepted, candidates = [], []
+        frontier = np.zeros(1, dtype=np.int64)
+        while len(frontier):
+            center = (self.__nodeMin[frontier] + self.__nodeMax[frontier]) * 0.5
+            extent = (self.__nodeMax[frontier] - self.__nodeMin[frontier]) * 0.5
+            distance = center @ normals.T + offsets
+            radius = extent @ absNormals.T
+            outside = (distance + radius < 0).any(axis=1)
+            inside = (distance - radius >= 0).all(axis=1)
+            accepted.append(frontier[inside & ~outside])
+            partial = frontier[~inside & ~outside]
+            isLeaf = self.__nodeLeft[partial] < 0
+            candidates.append(partial[isLeaf])
+            internal = partial[~isLeaf]
+            frontier = np.concatenate((self.__nodeLeft[internal], self.__nodeRight[internal]))
+
+        visible = [self.__GetNodeObjects(np.concatenate(accepted))]
+        candidateObjects = self.__GetNodeObjects(np.concatenate(candidates))
+        if len(candidateObjects):
+            distance = self.__centers[candidateObjects] @ normals.T + offsets
+            keep = (distance >= -self.__radii[candidateObjects][:, None]).all(axis=1)
+            visible.append(candidateObjects[keep])
+        return [self.objects[i] for i in np.sort(np.concatenate(visible)).tolist()]
+
+    def AddToRenderList(self, renderList, useObjectMaterial=False, removeBackFace=False):
+        """剔除后把可见的物体加入渲染列表，被剔除的物体标记为Culled
+        同一个mesh的实例合并成一次AddInstances调用；GameObject逐个调用AddObject（它会再做一次精确的包围球剔除）
+        """
+        visible = self.Cull(renderList.camera)
+        visibleIds = set(id(obj) for obj in visible)
+        instanceGroups = collections.OrderedDict()
+        for obj in self.objects:
+            if id(obj) not in visibleIds:
+                obj.SetBit(EGameObjectState.Culled)
+                continue
+            obj.ResetBit(EGameObjectState.Culled)
+            mesh = getattr(obj, 'mesh', None)
+            if mesh is not None:
+                instanceGroups.setdefault(id(mesh), []).append(obj)
+            else:
+                renderList.AddObject(obj, useObjectMaterial, removeBackFace)
+        for instances in instanceGroups.values():
+            renderList.AddInstances(instances, useObjectMaterial, removeBackFace)
+
+    def __UpdateSpheres(self, indices):
+        for i in indices:
+            obj = self.objects[i]
+            self.__centers[i] = (obj.worldPos.x, obj.worldPos.y, obj.worldPos.z)
+            self.__radii[i] = obj.maxRadius
+
+    def __BuildNode(self, start, end, depth, nodes, levels):
+        """构建覆盖order[start:end]的节点，返回节点下标：按球心在最长轴上的中位数把物体分成两半"""
+        node = len(nodes)
+        nodes.append([start, end, -1, -1])
+        levels[depth].append(node)
+        if end - start <= self.LeafSize:
+            return node
+
+        indices = self.__order[start:end]
+        centers = self.__centers[indices]
+        axis = np.argmax(centers.max(axis=0) - centers.min(axis=0))
+        self.__order[start:end] = indices[np.argsort(centers[:, axis], kind='stable')]
+        middle = (start + end) // 2
+        nodes[node][2] = self.__BuildNode(start, middle, depth + 1, nodes, levels)
+        nodes[node][3] = self.__BuildNode(middle, end, depth + 1, nodes, levels)
+        return node
+
+    def __Refit(self):
+        """按层重新计算节点的包围盒：每个节点的包围盒就是它覆盖的那一段物体的包围球的包围盒"""
+        if not self.objects:
+            return
+        radii = self.__radii[self.__order][:, None]
+        # 末尾加一行哨兵，使区间的结束位置也可以作为reduceat的下标
+        mins = np.concatenate((self.__centers[self.__order] - radii, np.zeros((1, 3))))
+        maxs = np.concatenate((self.__centers[self.__order] + radii, np.zeros((1, 3))))
+        for nodes in self.__levels:
+            # 同一层的节点区间互不重叠，按起点排序后把[start, end)交替排列，取偶数位置的结果
+            nodes = nodes[np.argsort(self.__nodeStart[nodes])]
+            bounds = np.stack((self.__nodeStart[nodes], self.__nodeEnd[nodes]), axis=1).ravel()
+            self.__nodeMin[nodes] = np.minimum.reduceat(mins, bounds, axis=0)[::2]
+            self.__nodeMax[nodes] = np.maximum.reduceat(maxs, bounds, axis=0)[::2]
+
+    def __GetNodeObjects(self, nodes):
+        """展开一组节点覆盖的所有物体下标"""
+        counts = self.__nodeEnd[nodes] - self.__nodeStart[nodes]
+        total = int(counts.sum())
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        return self.__order[np.repeat(self.__nodeStart[nodes], counts) + offsets]
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+import numpy as np
+from PIL import Image
+from graphics.base import ETextureFilterMode
+
+
+class Texture(object):
+    """纹理，图像在加载时一次性转成numpy数组，并预先生成mipmap链
+    每一级mipmap按行优先存储（levels[k][y, x]），宽高为上一级的一半（向上取整），直到1*1为止
+    """
+
+    def __init__(self, image):
+        data = np.asarray(image.convert('RGB'), dtype=np.float32)
+        self.width, self.height = image.size
+        self.levels = [data]
+        while data.shape[0] > 1 or data.shape[1] > 1:
+            data = self.__Downsample(data)
+            self.levels.append(data)
+
+    @classmethod
+    def Load(cls, filename):
+        with Image.open(filename) as im:
+            return cls(im)
+
+    @classmethod
+    def Wrap(cls, levels):
+        """用已有的mipmap链（例如共享内存中的数组）构造纹理，不复制数据"""
+        texture = cls.__new__(cls)
+        texture.height, texture.width = levels[0].shape[:2]
+        texture.levels = list(levels)
+        return texture
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    @staticmethod
+    def __Downsample(data):
+        """用2*2的盒式滤波生成下一级mipmap，奇数的边长先复制最后一行（列）补齐"""
+        h, w = data.shape[:2]
+        data = np.pad(data, ((0, h % 2), (0, w % 2), (0, 0)), mode='edge')
+        h, w = data.shape[:2]
+        if h == 1:
+            data = np.concatenate((data, data), axis=0)
+            h = 2
+        if w == 1:
+            data = np.concatenate((data, data), axis=1)
+            w = 2
+        return data.reshape(h // 2, 2, w // 2, 2, 3).mean(axis=(1, 3), dtype=np.float32)
+
+    def GetLod(self, dudx, dvdx, dudy, dvdy):
+        """根据uv对屏幕坐标的偏导数计算mipmap的级别（log2(一个像素覆盖的纹素数)，不小于0）"""
+        dx = np.hypot(np.asarray(dudx) * self.width, np.asarray(dvdx) * self.height)
+        dy = np.hypot(np.asarray(dudy) * self.width, np.asarray(dvdy) * self.height)
+        rho = np.maximum(np.maximum(dx, dy), 1)
+        return np.minimum(np.log2(rho), len(self.levels) - 1)
+
+    def Sample(self, us, vs, filterMode=ETextureFilterMode.Point, lods=None):
+        """对一组uv采样，返回N*3的RGB颜色
+        lods为每个采样点的mipmap级别（为None时采样原图），点采样和双线性插值取最接近的一级，三线性插值在相邻两级之间插值
+        """
+        us = np.asarray(us, dtype=np.float64)
+        vs = np.asarray(vs, dtype=np.float64)
+        if lods is None:
+            lods = np.zeros(len(us))
+        lods = np.broadcast_to(np.asarray(lods, dtype=np.float64), us.shape)
+
+        if filterMode == ETextureFilterMode.Trilinear:
+            lower = np.floor(lods).astype(np.int64)
+            t = (lods - lower)[:, None]
+            colors = self.__SampleLevels(lower, us, vs, True)
+            blend = t[:, 0] > 0
+            if blend.any():
+                upper = np.minimum(lower[blend] + 1, len(self.levels) - 1)
+                colors[blend] += (self.__SampleLevels(upper, us[blend], vs[blend], True) - colors[blend]) * t[blend]
+            return colors
+        levels = np.rint(lods).astype(np.int64)
+        return self.__SampleLevels(levels, us, vs, filterMode == ETextureFilterMode.Bilinear)
+
+    def __SampleLevels(self, levels, us, vs, bilinear):
+        """按各采样点所在的mipmap级别分组采样"""
+        colors = np.empty((len(us), 3), dtype=np.float64)
+        for level in np.unique(levels).tolist():
+            mask = levels == level
+            colors[mask] = self.__SampleLevel(self.levels[level], us[mask], vs[mask], bilinear)
+        return colors
+
+    @staticmethod
+    def __SampleLevel(data, us, vs, bilinear):
+        """在一级mipmap上采样，超出[0, 1]的uv夹到边缘的纹素"""
+        h, w = data.shape[:2]
+        if not bilinear:
+            xs = np.clip(np.rint(us * w), 0, w - 1).astype(np.int64)
+            ys = np.clip(np.rint(vs * h), 0, h - 1).astype(np.int64)
+            return data[ys, xs]
+
+        # 纹素中心在(i + 0.5) / w处
+        px = us * w - 0.5
+        py = vs * h - 0.5
+        x0 = np.floor(px)
+        y0 = np.floor(py)
+        tx = (px - x0)[:, None]
+        ty = (py - y0)[:, None]
+        x0 = x0.astype(np.int64)
+        y0 = y0.astype(np.int64)
+        x1 = np.clip(x0 + 1, 0, w - 1)
+        y1 = np.clip(y0 + 1, 0, h - 1)
+        x0 = np.clip(x0, 0, w - 1)
+        y0 = np.clip(y0, 0, h - 1)
+        top = data[y0, x0] + (data[y0, x1] - data[y0, x0]) * tx
+        bottom = data[y1, x0] + (data[y1, x1] - data[y1, x0]) * tx
+        return top + (bottom - top) * ty
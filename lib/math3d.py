@@ -15,14 +15,12 @@ class Matrix4x4(object):
 
     def __mul__(self, other):
         if isinstance(other, Vector4):
-            result = Vector4()
-            resultData = result.data
-            for i in range(4):
-                s = 0
-                for j in range(4):
-                    s += self.data[i][j] * other.data[j]
-                resultData[i] = s
-            return result
+            m = self.data
+            x, y, z, w = other.x, other.y, other.z, other.w
+            return Vector4(m[0][0] * x + m[0][1] * y + m[0][2] * z + m[0][3] * w,
+                           m[1][0] * x + m[1][1] * y + m[1][2] * z + m[1][3] * w,
+                           m[2][0] * x + m[2][1] * y + m[2][2] * z + m[2][3] * w,
+                           m[3][0] * x + m[3][1] * y + m[3][2] * z + m[3][3] * w)
 
         elif isinstance(other, Matrix4x4):
             result = Matrix4x4()
@@ -79,6 +77,20 @@ class Matrix4x4(object):
         func = rotateDict.get(seq)
         return func()
 
+    @staticmethod
+    def GetScaleMatrix(scale):
+        return Matrix4x4([[scale, 0, 0, 0],
+                          [0, scale, 0, 0],
+                          [0, 0, scale, 0],
+                          [0, 0, 0, 1]])
+
+    @staticmethod
+    def GetTranslateMatrix(x, y, z):
+        return Matrix4x4([[1, 0, 0, 0],
+                          [0, 1, 0, 0],
+                          [0, 0, 1, 0],
+                          [x, y, z, 1]])
+
 
 Matrix4x4.Zero = Matrix4x4([[0, 0, 0, 0],
                             [0, 0, 0, 0],
@@ -92,44 +104,26 @@ Matrix4x4.Identity = Matrix4x4([[1, 0, 0, 0],
 
 
 class Vector4(object):
-    """4D向量"""
+    """4D向量，分量直接存放在槽（__slots__）中，没有实例字典"""
+
+    __slots__ = ('x', 'y', 'z', 'w')
 
     Zero = [0, 0, 0, 1]
 
     def __init__(self, x=0, y=0, z=0, w=1):
-        self.data = [x, y, z, w]
-
-    @property
-    def x(self):
-        return self.data[0]
-
-    @x.setter
-    def x(self, value):
-        self.data[0] = value
-
-    @property
-    def y(self):
-        return self.data[1]
-
-    @y.setter
-    def y(self, value):
-        self.data[1] = value
-
-    @property
-    def z(self):
-        return self.data[2]
-
-    @z.setter
-    def z(self, value):
-        self.data[2] = value
+        self.x = x
+        self.y = y
+        self.z = z
+        self.w = w
 
     @property
-    def w(self):
-        return self.data[3]
+    def data(self):
+        """分量列表[x, y, z, w]（副本，修改它不会影响向量）"""
+        return [self.x, self.y, self.z, self.w]
 
-    @w.setter
-    def w(self, value):
-        self.data[3] = value
+    @data.setter
+    def data(self, value):
+        self.x, self.y, self.z, self.w = value
 
     @property
     def magnitude(self):
@@ -170,19 +164,14 @@ class Vector4(object):
         if isinstance(other, int) or isinstance(other, float):
             return Vector4(self.x * other, self.y * other, self.z * other)
         if isinstance(other, Vector4):
-            s = 0
-            for i in range(4):
-                s += self.data[i] + other.data[i]
-            return s
+            return (self.x + other.x) + (self.y + other.y) + (self.z + other.z) + (self.w + other.w)
         elif isinstance(other, Matrix4x4):
-            result = Vector4()
-            resultData = result.data
-            for col in range(4):
-                s = 0
-                for row in range(4):
-                    s += self.data[row] * other.data[row][col]
-                resultData[col] = s
-            return result
+            m0, m1, m2, m3 = other.data
+            x, y, z, w = self.x, self.y, self.z, self.w
+            return Vector4(x * m0[0] + y * m1[0] + z * m2[0] + w * m3[0],
+                           x * m0[1] + y * m1[1] + z * m2[1] + w * m3[1],
+                           x * m0[2] + y * m1[2] + z * m2[2] + w * m3[2],
+                           x * m0[3] + y * m1[3] + z * m2[3] + w * m3[3])
         else:
             raise Exception('The param other is not int, Vector4 or Matrix4x4 type')
 
@@ -201,6 +190,8 @@ class Vector4(object):
 class Color(object):
     """颜色"""
 
+    __slots__ = ('r', 'g', 'b', 'a')
+
     def __init__(self, r=0, g=0, b=0, a=255):
         self.r = r
         self.g = g
@@ -267,6 +258,8 @@ class ColorDefine(object):
 class Point(object):
     """简单2D点定义"""
 
+    __slots__ = ('x', 'y', 'z', 'color')
+
     def __init__(self, x=0, y=0, z=0, color=ColorDefine.Black):
         self.x = x
         self.y = y
@@ -295,6 +288,8 @@ class Point(object):
 
 
 class UVPoint(Point):
+    __slots__ = ('u', 'v', 'material')
+
     def __init__(self, x, y, z, color, u, v, material):
         super(UVPoint, self).__init__(x, y, z, color)
         self.u = u
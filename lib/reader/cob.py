@@ -1,11 +1,14 @@
 #!/usr/bin/env python3
 
 
+import os
+import re
 import parse
 import json
 from utils import log
 from graphics.object import GameObject
 from graphics.base import *
+from graphics.texture import Texture
 from lib.math3d import *
 
 
@@ -175,11 +178,10 @@ class COBReader(object):
                 if s['class'] == 'reflectance':
                     material.mode = materialShaderDict[s['name']]
                 elif s['class'] == 'color' and s['name'] == 'texture map':
-                    from PIL import Image
+                    # 文件名中的路径分隔符是Windows风格的，转换成当前系统的
                     filename = s['params'][0]['value'].replace('"', '')
-                    im = Image.open('res\\' + filename)
-                    material.texture = im.load()
-                    material.textureSize = im.size
+                    material.texture = Texture.Load(os.path.join('res', *re.split(r'[\\/]', filename)))
+                    material.textureSize = material.texture.size
             materialList.append(material)
 
         for p in data['polys']:
@@ -207,9 +209,13 @@ class COBReader(object):
 
         return obj
 
-    def LoadObject(self, adjustFlag=EVertexAdjustFlag.Null, textureFilterMode=ETextureFilterMode.Point):
+    def LoadObject(self, adjustFlag=EVertexAdjustFlag.Null, textureFilterMode=ETextureFilterMode.Point,
+                   useVertexPool=False):
         data = self.Load()
-        return self.Deserialize(data, adjustFlag, textureFilterMode)
+        obj = self.Deserialize(data, adjustFlag, textureFilterMode)
+        if useVertexPool:
+            obj.ConvertToVertexPool()
+        return obj
 
     def __GetLine(self, f):
         while True:
@@ -61,9 +61,12 @@ class PLGReader(object):
 
         return obj
 
-    def LoadObject(self):
+    def LoadObject(self, useVertexPool=False):
         data = self.Load()
-        return self.Deserialize(data)
+        obj = self.Deserialize(data)
+        if useVertexPool:
+            obj.ConvertToVertexPool()
+        return obj
 
     def __GetLine(self, f):
         while True:
@@ -11,6 +11,7 @@ from test.base_3shading import Main_Test3Shading
 from test.draw_texture_cube import Main_TestDrawTextureCube
 from test.poly_clipping import Main_TestDrawClippingPoly
 from test.zbuffer import Main_TestZBuffer
+from test.render_modes import Main_TestRenderModes
 
 
 def RunTest():
@@ -24,3 +25,4 @@ def RunTest():
     # Main_TestDrawTextureCube()
     # Main_TestDrawClippingPoly()
     Main_TestZBuffer()
+    # Main_TestRenderModes()
@@ -56,7 +56,7 @@ def TransformObject(objList, renderList, angle):
     for obj in objList:
         obj.Reset()
         obj.SetEulerRotation(angle, angle, 0)
-        renderList.AddObject(obj)
+        renderList.AddObject(obj, removeBackFace=True)
 
 
 def Output(buffer, angle):
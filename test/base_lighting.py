@@ -78,15 +78,16 @@ def AddObjectBatch(objModel, renderList, camera):
             log.logger.debug('obj world pos = {}'.format(pos))
             # 剔除物体
             if not camera.CullObject(objModel):
-                renderList.AddObject(objModel)
+                renderList.AddObject(objModel, removeBackFace=True)
 
 
 def TransformRenderList(renderList, camera, lightList):
-    renderList.CheckBackFace(camera)
-    renderList.TransformWorldToCamera(camera)
+    # 背面已在AddObject时剔除（CheckBackFace会跳过这些多边形），光照在变换到屏幕之后才计算，
+    # 所以这里先在世界坐标中计算并缓存多边形法线
+    for poly in renderList.polyList:
+        poly.GetNormal()
+    renderList.TransformWorldToScreen(camera)
     renderList.Sort()
-    renderList.TransformCameraToPerspective(camera)
-    renderList.TransformPerspectiveToScreen(camera)
     renderList.CalculateLighting(lightList)
 
 
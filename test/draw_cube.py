@@ -20,12 +20,8 @@ def DrawCube(filename, removeBackFace):
 
     buffer = RenderBuffer(color=ColorDefine.White)
     renderList = RenderList(Rasterizer(buffer), camera)
-    renderList.AddObject(obj, useObjectMaterial=True)
-    if removeBackFace:
-        renderList.CheckBackFace(camera)
-    renderList.TransformWorldToCamera(camera)
-    renderList.TransformCameraToPerspective(camera)
-    renderList.TransformPerspectiveToScreen(camera)
+    renderList.AddObject(obj, useObjectMaterial=True, removeBackFace=removeBackFace)
+    renderList.TransformWorldToScreen(camera)
     renderList.RenderWire()
 
     renderer = ImageRenderer(filename)
@@ -26,7 +26,7 @@ def DrawCube(filename, removeBackFace):
         DirectionalLight(ColorDefine.White, direction=Vector4(-1, 0.5, -1))
     ]
     renderList = RenderList(Rasterizer(buffer), camera)
-    renderList.AddObject(obj)
+    renderList.AddObject(obj, removeBackFace=True)
     renderList.PreRender(camera, lightList)
     renderList.RenderSolid()
 
@@ -18,27 +18,38 @@ def Main_TestUVNCameraSequence():
     if not os.path.exists(outputDir):
         os.mkdir(outputDir)
 
-    camera, objModel, buffer, renderList = Init()
+    camera, instances, buffer, renderList = Init()
 
     for angle in range(0, 360, 10):
         log.logger.info('Rendering angle={}...'.format(angle))
-        RenderOneFrame(camera, objModel, buffer, renderList, angle)
+        RenderOneFrame(camera, instances, buffer, renderList, angle)
 
 
 def Init():
     """初始化一些固定物体并返回"""
     camera = Camera(cameraType=ECameraType.UVN, nearClipZ=50, farClipZ=8000)
-    objModel = PLGReader('res/tank.plg').LoadObject()
+    objModel = PLGReader('res/tank.plg').LoadObject(useVertexPool=True)
     objModel.material.color = ColorDefine.Black
+    instances = CreateInstances(objModel)
     buffer = RenderBuffer(color=ColorDefine.White)
     renderList = RenderList(Rasterizer(buffer), camera)
-    return camera, objModel, buffer, renderList
+    return camera, instances, buffer, renderList
 
 
-def RenderOneFrame(camera, objModel, buffer, renderList, angle):
+def CreateInstances(objModel):
+    """在网格上创建共享同一个模型的实例"""
+    instances = []
+    for x in range(-numObjects // 2, numObjects // 2):
+        for z in range(-numObjects // 2, numObjects // 2):
+            pos = Vector4(x * objectSpacing + objectSpacing // 2, 0, z * objectSpacing + objectSpacing // 2)
+            instances.append(GameObjectInstance(objModel, worldPos=pos))
+    return instances
+
+
+def RenderOneFrame(camera, instances, buffer, renderList, angle):
     buffer.Clear(color=ColorDefine.White)
     SetCameraParams(camera, angle)
-    AddObjectBatch(objModel, renderList, camera)
+    AddObjectBatch(instances, renderList, camera)
     TransformRenderList(renderList, camera)
     renderList.RenderWire()
     Output(buffer, angle)
@@ -54,21 +65,14 @@ def SetCameraParams(camera, angle):
     camera.lookAt = Vector4()
 
 
-def AddObjectBatch(objModel, renderList, camera):
-    """根据原模型批量添加到渲染列表中，并根据相机参数剔除物体"""
+def AddObjectBatch(instances, renderList, camera):
+    """把所有实例批量添加到渲染列表中，并根据相机参数剔除物体"""
     renderList.Reset()
-    for x in range(-numObjects // 2, numObjects // 2):
-        for z in range(-numObjects // 2, numObjects // 2):
-            pos = Vector4(x * objectSpacing + objectSpacing // 2, 0, z * objectSpacing + objectSpacing // 2)
-            objModel.Reset()
-            objModel.SetWorldPosition(pos)
-            renderList.AddObject(objModel, useObjectMaterial=True)
+    renderList.AddInstances(instances, useObjectMaterial=True)
 
 
 def TransformRenderList(renderList, camera):
-    renderList.TransformWorldToCamera(camera)
-    renderList.TransformCameraToPerspective(camera)
-    renderList.TransformPerspectiveToScreen(camera)
+    renderList.TransformWorldToScreen(camera)
 
 
 def Output(buffer, angle):
@@ -42,7 +42,7 @@ def RenderOneFrame(camera, obj, buffer, renderList, lightList, objZ):
     buffer.Clear(color=ColorDefine.Black)
     renderList.Reset()
     obj.SetTransform(scale=10, eulerRotation=(0, 135, 0), worldPos=Vector4(0, 0, objZ))
-    renderList.AddObject(obj)
+    renderList.AddObject(obj, removeBackFace=True)
     renderList.PreRender(camera, lightList)
     renderList.RenderSolid()
 
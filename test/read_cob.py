@@ -16,12 +16,9 @@ def Main_TestReadCOB():
 
     buffer = RenderBuffer(color=ColorDefine.Black)
     renderList = RenderList(Rasterizer(buffer), camera)
-    renderList.AddObject(obj)
+    renderList.AddObject(obj, removeBackFace=True)
 
-    renderList.CheckBackFace(camera)
-    renderList.TransformWorldToCamera(camera)
-    renderList.TransformCameraToPerspective(camera)
-    renderList.TransformPerspectiveToScreen(camera)
+    renderList.TransformWorldToScreen(camera)
     renderList.RenderWire()
 
     renderer = ImageRenderer('output/read_cob.png')
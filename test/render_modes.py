@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+
+import os
+import numpy as np
+from PIL import Image
+from graphics.object import *
+from graphics.base import *
+from graphics.render import *
+from graphics.scene import Scene
+from graphics.texture import Texture
+from lib.math3d import Color
+from lib.reader.plg import PLGReader
+
+outputDir = 'output/render_modes'
+# 缓存清空成alpha为0的颜色，画过的像素alpha为255，用alpha判断覆盖范围
+clearColor = Color(0, 0, 0, 0)
+
+
+def Main_TestRenderModes():
+    """把各种可选的渲染方式与默认方式对比，结果不一致（或超出误差上限）时断言失败"""
+    if not os.path.exists(outputDir):
+        os.mkdir(outputDir)
+
+    log.logger.info('Comparing rasterize modes on a shared-edge grid...')
+    CompareRasterizeModes()
+    log.logger.info('Comparing fixed point interpolation with float interpolation...')
+    CompareInterpolationModes()
+    log.logger.info('Comparing parallel rasterizer with single process rasterizer...')
+    CompareParallelRasterizer()
+    log.logger.info('Comparing subdivided affine texture mapping with perspective texture mapping...')
+    CompareTextureMappingModes()
+    log.logger.info('Comparing scene BVH culling with culling every object...')
+    CompareSceneCull()
+    log.logger.info('Comparing incremental sort with full sort...')
+    CompareIncrementalSort()
+
+
+def GetRandomTriangles(numTriangles, seed=0):
+    """在略大于屏幕的范围内随机生成三角形，返回positions、invZ和colors"""
+    rand = np.random.RandomState(seed)
+    positions = rand.uniform(-50, Buffer.DefaultWidth + 50, (numTriangles, 3, 2))
+    invZ = 1 / rand.uniform(10, 100, (numTriangles, 3))
+    colors = np.concatenate((rand.uniform(0, 255, (numTriangles, 3, 3)), np.full((numTriangles, 3, 1), 255.0)),
+                            axis=2)
+    return positions, invZ, colors
+
+
+def GetGridTriangles(size, numCells, margin, seed=0):
+    """把size*size的区域（四周留出margin）分成numCells*numCells个格子，每个格子分成两个三角形，
+    内部的格点随机抖动到非整数坐标，相邻三角形共享边，所以网格内的每个像素应该恰好被一个三角形覆盖
+    """
+    rand = np.random.RandomState(seed)
+    cell = (size - 2 * margin) / numCells
+    coords = margin + 0.3 + np.arange(numCells + 1) * cell
+    points = np.stack(np.meshgrid(coords, coords), axis=2)
+    points[1:-1, 1:-1] += rand.uniform(-1.5, 1.5, (numCells - 1, numCells - 1, 2))
+    triangles = []
+    for j in range(numCells):
+        for i in range(numCells):
+            a, b, c, d = points[j, i], points[j, i + 1], points[j + 1, i], points[j + 1, i + 1]
+            triangles.append((a, b, d))
+            triangles.append((a, d, c))
+    return np.array(triangles, dtype=np.float64)
+
+
+def CompareRasterizeModes(size=64, numCells=6, margin=4):
+    """分块和子像素光栅化与扫描线光栅化的覆盖范围必须完全相同：共享边上的像素只属于一个三角形，没有缝隙也没有重复"""
+    triangles = GetGridTriangles(size, numCells, margin)
+    interior = slice(margin + 1, size - margin - 1)
+    # 每个三角形一种灰度
+    shades = np.arange(len(triangles)) * 97 % 256
+    colors = np.full((len(triangles), 3, 4), 255.0)
+    colors[..., :3] = shades[:, None, None]
+    coverages = {}
+    for mode in ERasterizeMode:
+        # 逐个三角形绘制，累计每个像素被覆盖的次数
+        coverage = np.zeros((size, size), dtype=np.int64)
+        for triangle in triangles:
+            buffer = RenderBuffer(size, size, color=clearColor)
+            Rasterizer(buffer, rasterizeMode=mode).DrawTriangles(triangle[None], np.ones((1, 3)),
+                                                                 np.full((1, 3, 4), 255.0))
+            coverage += buffer.data[..., 3] > 0
+        assert coverage.max() <= 1, '{}: {} pixels drawn twice'.format(mode.name, (coverage > 1).sum())
+        assert coverage[interior, interior].min() == 1, \
+            '{}: {} pixels not drawn'.format(mode.name, (coverage[interior, interior] == 0).sum())
+        coverages[mode] = coverage
+
+        buffer = RenderBuffer(size, size, color=ColorDefine.Black)
+        Rasterizer(buffer, rasterizeMode=mode).DrawTriangles(triangles, np.ones((len(triangles), 3)), colors)
+        ImageRenderer('{}/grid_{}.png'.format(outputDir, mode.name.lower())).Render(buffer)
+
+    for mode in (ERasterizeMode.Tile, ERasterizeMode.SubPixel):
+        diff = (coverages[mode] != coverages[ERasterizeMode.Scanline]).sum()
+        assert diff == 0, '{}: coverage differs from Scanline in {} pixels'.format(mode.name, diff)
+
+
+def CompareInterpolationModes(numTriangles=60):
+    """定点插值与浮点插值的覆盖范围相同，颜色每个通道最多相差1（取整方式不同）"""
+    positions, invZ, colors = GetRandomTriangles(numTriangles)
+    results = []
+    for mode in EInterpolationMode:
+        buffer = RenderBuffer(color=clearColor)
+        Rasterizer(buffer, ZBuffer(), interpolationMode=mode).DrawTriangles(positions, invZ, colors)
+        ImageRenderer('{}/interpolation_{}.png'.format(outputDir, mode.name.lower())).Render(buffer)
+        results.append(buffer.data.astype(np.int64))
+
+    floatResult, fixedPointResult = results
+    diff = (floatResult[..., 3] != fixedPointResult[..., 3]).sum()
+    assert diff == 0, 'FixedPoint: coverage differs from Float in {} pixels'.format(diff)
+    maxDiff = np.abs(floatResult - fixedPointResult).max()
+    assert maxDiff <= 1, 'FixedPoint: color differs from Float by {}'.format(maxDiff)
+
+
+def CompareParallelRasterizer(numTriangles=60, numProcesses=4):
+    """多进程分块并行光栅化的颜色缓存和Z缓存必须与单进程的结果完全相同（各种光栅化方式，普通和分层Z缓存）"""
+    positions, invZ, colors = GetRandomTriangles(numTriangles, seed=1)
+    for mode in ERasterizeMode:
+        for zbufferType in (ZBuffer, HierarchicalZBuffer):
+            results = []
+            for parallel in (False, True):
+                buffer = RenderBuffer(color=ColorDefine.Black)
+                zbuffer = zbufferType()
+                rasterizer = Rasterizer(buffer, zbuffer, mode)
+                if parallel:
+                    rasterizer = ParallelRasterizer(rasterizer, numProcesses)
+                rasterizer.DrawTriangles(positions, invZ, colors)
+                if parallel:
+                    rasterizer.Close()
+                results.append((buffer.data.copy(), zbuffer.GetData().copy()))
+
+            (color, depth), (parallelColor, parallelDepth) = results
+            assert (color == parallelColor).all() and (depth == parallelDepth).all(), \
+                'ParallelRasterizer({}, {}): result differs from single process'.format(mode.name,
+                                                                                        zbufferType.__name__)
+
+
+def CompareTextureMappingModes():
+    """分段仿射纹理映射与逐像素透视矫正的误差上限
+    纹理的R、G通道分别等于纹素的x、y坐标，双线性采样后像素颜色就是以纹素为单位的u、v。
+    在长度为L的一段中，仿射插值与精确值的误差为(u1 - u0) * t * (1 - t) * (q1 - q0) / ((1 - t) * q0 + t * q1)，q = 1/z，
+    所以不超过L^2 * |dq/dx| * max|du/dx| / 4 / min(q)，其中|du/dx| <= (|d(u*q)/dx| + max(u) * |dq/dx|) / min(q)，
+    再加上采样和颜色调制取整的1
+    """
+    textureSize = 256
+    ramp = np.arange(textureSize, dtype=np.uint8)
+    image = np.zeros((textureSize, textureSize, 3), dtype=np.uint8)
+    image[..., 0] = ramp[None, :]
+    image[..., 1] = ramp[:, None]
+    material = Material()
+    material.texture = Texture(Image.fromarray(image))
+    material.textureFilterMode = ETextureFilterMode.Bilinear
+
+    # 左边近右边远的四边形
+    corners = np.array([(40, 120), (760, 40), (760, 760), (40, 680)], dtype=np.float64)
+    depths = np.array([20, 300, 300, 20], dtype=np.float64)
+    textureCoords = np.array([(0, 0), (1, 0), (1, 1), (0, 1)], dtype=np.float64)
+    indices = np.array([[0, 1, 2], [0, 2, 3]])
+    positions, invZ, uvs = corners[indices], 1 / depths[indices], textureCoords[indices]
+    colors = np.full((len(indices), 3, 4), 255.0)
+
+    results = []
+    for mode in ETextureMappingMode:
+        buffer = RenderBuffer(color=clearColor)
+        Rasterizer(buffer, ZBuffer(), textureMappingMode=mode).DrawTriangles(positions, invZ, colors, uvs,
+                                                                             [0] * len(indices), [material])
+        ImageRenderer('{}/texture_{}.png'.format(outputDir, mode.name.lower())).Render(buffer)
+        results.append(buffer.data.astype(np.int64))
+
+    perspectiveResult, affineResult = results
+    covered = perspectiveResult[..., 3] > 0
+    diff = (covered != (affineResult[..., 3] > 0)).sum()
+    assert diff == 0, 'SubdividedAffine: coverage differs from Perspective in {} pixels'.format(diff)
+
+    # u和v分别计算上限（以纹素为单位），取两个三角形中较大的
+    spanLength = Rasterizer.AffineSpanLength
+    bounds = np.zeros(2)
+    for triangle, q, uv in zip(positions, invZ, uvs):
+        dqdx = GetGradientX(triangle, q)
+        for k in range(2):
+            dudx = (abs(GetGradientX(triangle, uv[:, k] * q)) + uv[:, k].max() * abs(dqdx)) / q.min()
+            bounds[k] = max(bounds[k], spanLength ** 2 * abs(dqdx) * dudx / (4 * q.min()) * textureSize + 1)
+    errors = np.abs(perspectiveResult[..., :2] - affineResult[..., :2])[covered].max(axis=0)
+    log.logger.info('SubdividedAffine max error (u, v) = {} texels, bound = {} texels'.format(
+        errors.tolist(), np.round(bounds, 2).tolist()))
+    assert (errors <= bounds).all(), 'SubdividedAffine: error {} exceeds bound {}'.format(errors.tolist(),
+                                                                                          bounds.tolist())
+
+
+def GetGradientX(triangle, values):
+    """三角形上线性变化的量对屏幕x的偏导数"""
+    (x0, y0), (x1, y1), (x2, y2) = triangle
+    area = (x1 - x0) * (y2 - y0) - (x2 - x0) * (y1 - y0)
+    return ((values[1] - values[0]) * (y2 - y0) - (values[2] - values[0]) * (y1 - y0)) / area
+
+
+def InitInstances(numInstances=400):
+    """随机摆放的立方体实例、相机和光源"""
+    rand = np.random.RandomState(7)
+    camera = Camera(cameraType=ECameraType.UVN, pos=Vector4(0, 300, -600), nearClipZ=50, farClipZ=3000)
+    mesh = PLGReader('res/cube.plg').LoadObject()
+    mesh.material.color = ColorDefine.White
+    instances = [GameObjectInstance(mesh, Vector4(*rand.uniform(-1500, 1500, 3)), tuple(rand.uniform(0, 360, 3)),
+                                    rand.uniform(2, 6)) for i in range(numInstances)]
+    lightList = [
+        AmbientLight(ColorDefine.Gray),
+        DirectionalLight(ColorDefine.White, direction=Vector4(-1, 0.5, -1))
+    ]
+    return camera, instances, lightList
+
+
+def CompareSceneCull():
+    """场景的BVH剔除必须与逐个物体用视锥体平面测试包围球的结果相同，物体移动并Update之后也一样；
+    用场景加入渲染列表与直接加入所有实例的渲染结果也必须相同
+    """
+    camera, instances, lightList = InitInstances()
+    scene = Scene()
+    for instance in instances:
+        scene.Add(instance)
+    buffer = RenderBuffer(color=ColorDefine.Black)
+    zbuffer = ZBuffer()
+    renderList = RenderList(Rasterizer(buffer, zbuffer), camera)
+    planes = camera.GetFrustumPlanes()
+
+    for frame in range(3):
+        centers = np.array([(obj.worldPos.x, obj.worldPos.y, obj.worldPos.z) for obj in instances])
+        radii = np.array([obj.maxRadius for obj in instances])
+        inside = (centers @ planes[:, :3].T + planes[:, 3] >= -radii[:, None]).all(axis=1).tolist()
+        expected = [obj for obj, isInside in zip(instances, inside) if isInside]
+        assert scene.Cull(camera) == expected, 'Scene: culling result differs from testing every object'
+
+        results = []
+        for useScene in (False, True):
+            buffer.Clear(color=ColorDefine.Black)
+            zbuffer.Clear()
+            renderList.Reset()
+            if useScene:
+                scene.AddToRenderList(renderList, removeBackFace=True)
+            else:
+                renderList.AddInstances(instances, removeBackFace=True)
+            renderList.PreRender(camera, lightList)
+            renderList.RenderSolid()
+            results.append(buffer.data.copy())
+        assert (results[0] == results[1]).all(), 'Scene: rendering result differs from adding every instance'
+        ImageRenderer('{}/scene_{}.png'.format(outputDir, frame)).Render(buffer)
+
+        # 移动三分之一的物体
+        movedInstances = instances[::3]
+        for obj in movedInstances:
+            obj.SetWorldPosition(Vector4(obj.worldPos.x + 100, obj.worldPos.y, obj.worldPos.z - 50))
+        scene.Update(movedInstances)
+
+
+def CompareIncrementalSort(numFrames=6):
+    """物体每帧转动一点，增量排序（从上一帧的顺序开始）与完整排序的渲染结果必须相同（不用Z缓存，完全依赖排序）"""
+    camera, instances, lightList = InitInstances()
+    renderLists = [RenderList(Rasterizer(RenderBuffer(color=ColorDefine.Black)), camera) for i in range(2)]
+    for frame in range(numFrames):
+        for obj in instances:
+            obj.SetEulerRotation(obj.rotation.x + 2, obj.rotation.y + 1, obj.rotation.z)
+        for renderList, incremental in zip(renderLists, (False, True)):
+            renderList.rasterizer.buffer.Clear(color=ColorDefine.Black)
+            renderList.Reset()
+            renderList.AddInstances(instances, removeBackFace=True)
+            renderList.PreRender(camera, lightList, incremental)
+            renderList.RenderSolid()
+        fullResult, incrementalResult = [renderList.rasterizer.buffer.data for renderList in renderLists]
+        assert (fullResult == incrementalResult).all(), 'Incremental sort: frame {} differs from full sort'.format(frame)
+    ImageRenderer('{}/sort.png'.format(outputDir)).Render(renderLists[1].rasterizer.buffer)
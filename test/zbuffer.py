@@ -35,7 +35,8 @@ def Init():
 
     buffer = RenderBuffer(color=ColorDefine.Black)
     # 可以将下面置为None看看错误的效果
-    zbuffer = ZBuffer()
+    # 分层Z缓存可以整块丢弃被遮挡的像素，换成ZBuffer()结果相同
+    zbuffer = HierarchicalZBuffer()
     lightList = [
         AmbientLight(ColorDefine.Gray),
         DirectionalLight(ColorDefine.White, direction=Vector4(-1, 0.5, -1))
@@ -52,8 +53,8 @@ def RenderOneFrame(camera, texturedCube, normalCube, buffer, zbuffer, renderList
 
     texturedCube.SetWorldPosition(Vector4(0, 0, objZ))
     renderList.Reset()
-    renderList.AddObject(texturedCube)
-    renderList.AddObject(normalCube, useObjectMaterial=True)
+    renderList.AddObject(texturedCube, removeBackFace=True)
+    renderList.AddObject(normalCube, useObjectMaterial=True, removeBackFace=True)
     renderList.PreRender(camera, lightList)
     renderList.RenderSolid()
 